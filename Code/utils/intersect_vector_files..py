@@ -1,10 +1,20 @@
-import geopandas as gpd
 from pathlib import Path
 
+import geopandas as gpd
+
+# The engines live in an importable module, so process-pool workers can find them
+from partitioned_overlay import overlay_reference, partitioned_overlay
+
+
 def intersect_ecosystem_with_mpa(
     ecosystem_path: str,
     mpa_path: str,
     out_intersection: str | None = None,
+    method: str = "overlay",
+    workers: int | None = None,
+    cell_size: float | None = None,
+    max_pairs_per_task: int = 500,
+    memory_limit_mb: int = 2048,
 ):
     """
     Compute the geometric intersection (ecosystem ∩ MPA)
@@ -12,8 +22,15 @@ def intersect_ecosystem_with_mpa(
 
     - Intersection geometries & attributes come from ECOSYSTEM layer.
     - No area calculations.
+    - method="overlay" runs one gpd.overlay in this process.
+    - method="partitioned" clips only STRtree candidate pairs, grouped by
+      ecosystem feature and grid cell, in a process pool (see
+      partitioned_overlay). Rows come out in (ecosystem, MPA) order.
     """
 
+    if method not in ("overlay", "partitioned"):
+        raise ValueError(f"Unknown method {method!r}; use 'overlay' or 'partitioned'.")
+
     # Load datasets
     gdf_ecosystem = gpd.read_file(ecosystem_path)
     gdf_mpa       = gpd.read_file(mpa_path)
@@ -23,25 +40,20 @@ def intersect_ecosystem_with_mpa(
         print("Ecosystem dataset is empty.")
         return gpd.GeoDataFrame(geometry=[])
 
-    # Fast bounding-box prefilter
-    pref_idx = gpd.sjoin(
-        gdf_mpa[["geometry"]],
-        gdf_ecosystem[["geometry"]],
-        predicate="intersects",
-        how="inner"
-    )["index_right"].unique()
-
-    if len(pref_idx) == 0:
-        print("No intersections found.")
-        return gpd.GeoDataFrame(geometry=[])
-
-    gdf_ecosystem_pref = gdf_ecosystem.loc[pref_idx]
-
-    # Exact intersection — ecosystem first so resulting geometry/attrs come from ecosystem
-    inter = gpd.overlay(gdf_ecosystem_pref, gdf_mpa, how="intersection")
-
-    # Keep only ecosystem attributes + geometry
-    inter = inter[gdf_ecosystem_pref.columns]
+    if method == "partitioned":
+        inter, _ = partitioned_overlay(
+            gdf_ecosystem,
+            gdf_mpa,
+            workers=workers,
+            cell_size=cell_size,
+            max_pairs_per_task=max_pairs_per_task,
+            memory_limit_mb=memory_limit_mb,
+        )
+    else:
+        inter = overlay_reference(gdf_ecosystem, gdf_mpa)
+
+    if inter.empty:
+        return inter
 
     # Optional output
     if out_intersection:
@@ -60,6 +72,8 @@ if __name__ == "__main__":
     mpa_path       = input("Path to protected areas file: ").strip()
     out_geojson    = input("Output GeoJSON path (leave empty to skip saving): ").strip()
 
+    method         = input("Method (overlay/partitioned) [overlay]: ").strip() or "overlay"
+
     if out_geojson == "":
         out_geojson = None
 
@@ -67,6 +81,7 @@ if __name__ == "__main__":
         ecosystem_path=ecosystem_path,
         mpa_path=mpa_path,
         out_intersection=out_geojson,
+        method=method,
     )
 
     print(result)
@@ -0,0 +1,319 @@
+# Ecosystem ∩ MPA overlay engines used by intersect_vector_files..py.
+# Kept in an importable module (the `..py` file name cannot be imported) so that
+# process-pool workers started with spawn (the macOS default) can find the task
+# functions; notebooks should import from here rather than paste them inline.
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+import geopandas as gpd
+import shapely
+from shapely import STRtree
+
+
+def overlay_reference(gdf_ecosystem: gpd.GeoDataFrame, gdf_mpa: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Single-process sjoin prefilter + gpd.overlay (the original engine)."""
+
+    # Fast bounding-box prefilter
+    pref_idx = gpd.sjoin(
+        gdf_mpa[["geometry"]],
+        gdf_ecosystem[["geometry"]],
+        predicate="intersects",
+        how="inner"
+    )["index_right"].unique()
+
+    if len(pref_idx) == 0:
+        print("No intersections found.")
+        return gpd.GeoDataFrame(geometry=[])
+
+    gdf_ecosystem_pref = gdf_ecosystem.loc[pref_idx]
+
+    # Exact intersection — ecosystem first so resulting geometry/attrs come from ecosystem
+    inter = gpd.overlay(gdf_ecosystem_pref, gdf_mpa, how="intersection")
+
+    # Keep only ecosystem attributes + geometry
+    return inter[gdf_ecosystem_pref.columns]
+
+
+# -------------------------------------------------------------------
+# Partitioned engine
+# -------------------------------------------------------------------
+def _polygonal(geom):
+    """Polygonal part of an intersection, as gpd.overlay keeps it (None if there is none)."""
+    if geom is None or geom.is_empty:
+        return None
+    if geom.geom_type in ("Polygon", "MultiPolygon"):
+        return geom
+    if geom.geom_type == "GeometryCollection":
+        parts = [part for part in shapely.get_parts(geom) if part.geom_type in ("Polygon", "MultiPolygon")]
+        if parts:
+            return shapely.union_all(parts)
+    # Lines / points from features that only touch
+    return None
+
+
+# Per-process state for the clip workers: the shared file of ecosystem WKB and the
+# last ecosystem feature parsed from it (tasks arrive grouped by feature)
+_clip_state = {}
+
+
+def _init_clip_worker(ecosystem_wkb_path):
+    _clip_state.update(fd=os.open(ecosystem_wkb_path, os.O_RDONLY), feature=None, geometry=None)
+
+
+def _ecosystem_geometry(e, offset, length):
+    if _clip_state["feature"] != e:
+        _clip_state["geometry"] = shapely.from_wkb(os.pread(_clip_state["fd"], length, offset))
+        _clip_state["feature"] = e
+    return _clip_state["geometry"]
+
+
+def _clip_task(e: int, offset: int, length: int, mpa_wkbs: list, pairs: list):
+    """Intersect ecosystem feature `e` (read from the shared file) with a batch of nearby MPAs."""
+    eco = _ecosystem_geometry(e, offset, length)
+    mpas = shapely.from_wkb(mpa_wkbs)
+
+    # Cut the (possibly huge) ecosystem geometry down to this batch's extent first
+    piece = shapely.intersection(eco, shapely.box(*shapely.total_bounds(mpas)))
+    clipped = shapely.intersection(piece, mpas)
+
+    results = []
+    for pair, geom in zip(pairs, clipped):
+        geom = _polygonal(geom)
+        if geom is not None:
+            results.append((pair, shapely.to_wkb(geom)))
+    return results
+
+
+def _candidate_tasks(gdf_ecosystem, gdf_mpa, cell_size, max_pairs_per_task):
+    """Group STRtree candidate pairs into tasks of one ecosystem feature x one grid cell."""
+    eco_geoms = gdf_ecosystem.geometry.values
+    mpa_geoms = gdf_mpa.geometry.values
+
+    eco_idx, mpa_idx = STRtree(mpa_geoms).query(eco_geoms, predicate="intersects")
+
+    if cell_size is None:
+        minx, miny, maxx, maxy = gdf_mpa.total_bounds
+        cell_size = max(maxx - minx, maxy - miny) / 32 or 1.0
+
+    mpa_bounds = shapely.bounds(mpa_geoms)
+    cell_x = np.floor((mpa_bounds[:, 0] + mpa_bounds[:, 2]) / 2 / cell_size).astype("int64")
+    cell_y = np.floor((mpa_bounds[:, 1] + mpa_bounds[:, 3]) / 2 / cell_size).astype("int64")
+
+    groups = defaultdict(list)
+    for e, m in zip(eco_idx.tolist(), mpa_idx.tolist()):
+        groups[(e, cell_x[m], cell_y[m])].append(m)
+
+    tasks = []
+    for (e, _, _), members in sorted(groups.items()):
+        members.sort()
+        for start in range(0, len(members), max_pairs_per_task):
+            tasks.append((e, members[start:start + max_pairs_per_task]))
+    return tasks, len(eco_idx)
+
+
+def partitioned_overlay(
+    gdf_ecosystem: gpd.GeoDataFrame,
+    gdf_mpa: gpd.GeoDataFrame,
+    workers: int | None = None,
+    cell_size: float | None = None,
+    max_pairs_per_task: int = 500,
+    memory_limit_mb: int = 2048,
+):
+    """
+    Ecosystem ∩ MPA intersection computed from candidate pairs in a process pool.
+
+    Candidate pairs come from an STRtree over the MPAs. Pairs are grouped by
+    ecosystem feature and by the grid cell (of size `cell_size`, in CRS units)
+    of the MPA centre, so each task clips the ecosystem geometry once to the
+    extent of its batch and intersects only that piece with up to
+    `max_pairs_per_task` MPAs. The ecosystem geometries are written once to a
+    temporary file that workers read by offset (each worker keeps only the
+    feature it is working on), so only the MPA geometries travel with the
+    tasks. Tasks are submitted only while the MPA geometry in flight stays
+    under `memory_limit_mb`. Output rows are sorted by
+    (ecosystem row, MPA row) whatever order the tasks finish in, so repeated
+    runs give identical output.
+
+    Parameters
+    ----------
+    gdf_ecosystem : geopandas.GeoDataFrame
+        Ecosystem features (attributes are kept).
+    gdf_mpa : geopandas.GeoDataFrame
+        Protected areas. Reprojected to the ecosystem CRS if needed.
+    workers : int or None, optional
+        Worker processes. If None, uses all CPUs.
+    cell_size : float or None, optional
+        Grid cell size in CRS units. If None, 1/32 of the MPA extent.
+    max_pairs_per_task : int, optional
+        Maximum MPAs intersected per task (default: 500).
+    memory_limit_mb : int, optional
+        Approximate cap on MPA geometry held by queued and running tasks
+        (default: 2048). Workers also hold one ecosystem feature each.
+
+    Returns
+    -------
+    inter : geopandas.GeoDataFrame
+        Intersection GeoDataFrame with the ecosystem columns.
+    pairs : numpy.ndarray
+        (n, 2) array of the (ecosystem row, MPA row) of each output row.
+    """
+
+    if gdf_mpa.crs != gdf_ecosystem.crs:
+        gdf_mpa = gdf_mpa.to_crs(gdf_ecosystem.crs)
+
+    gdf_ecosystem = gdf_ecosystem.reset_index(drop=True)
+    gdf_mpa = gdf_mpa[["geometry"]].reset_index(drop=True)
+
+    tasks, n_pairs = _candidate_tasks(gdf_ecosystem, gdf_mpa, cell_size, max_pairs_per_task)
+    print(f"{n_pairs} candidate pairs in {len(tasks)} tasks")
+
+    # Ecosystem features with candidates, written once for all workers
+    tmp_dir = tempfile.mkdtemp(prefix="partitioned_overlay_")
+    ecosystem_wkb_path = os.path.join(tmp_dir, "ecosystem.wkb")
+    extents = {}
+    with open(ecosystem_wkb_path, "wb") as f:
+        for e in sorted({e for e, _ in tasks}):
+            wkb = shapely.to_wkb(gdf_ecosystem.geometry.values[e])
+            extents[e] = (f.tell(), len(wkb))
+            f.write(wkb)
+
+    mpa_wkb = shapely.to_wkb(gdf_mpa.geometry.values)
+    limit_bytes = memory_limit_mb * 2**20
+    # Parsed geometries and results take a few times the WKB size
+    overhead = 4
+
+    results = []
+    started = time.time()
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_clip_worker, initargs=(ecosystem_wkb_path,)
+    )
+    try:
+        pending = {}
+        in_flight = 0
+        next_task = 0
+        done = 0
+
+        while next_task < len(tasks) or pending:
+            # Submit while under the memory cap (always keep at least one task running)
+            while next_task < len(tasks):
+                e, members = tasks[next_task]
+                mpas = [mpa_wkb[m] for m in members]
+                size = overhead * sum(len(w) for w in mpas)
+                if pending and in_flight + size > limit_bytes:
+                    break
+                future = executor.submit(_clip_task, e, *extents[e], mpas, [(e, m) for m in members])
+                pending[future] = size
+                in_flight += size
+                next_task += 1
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                in_flight -= pending.pop(future)
+                results.extend(future.result())
+                done += 1
+                if done % 100 == 0 or done == len(tasks):
+                    print(f"  {done}/{len(tasks)} tasks, {len(results)} intersections, {time.time() - started:.0f}s")
+    finally:
+        executor.shutdown()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if not results:
+        print("No intersections found.")
+        return gpd.GeoDataFrame(geometry=[]), np.empty((0, 2), dtype="int64")
+
+    results.sort(key=lambda item: item[0])
+    pairs = np.array([pair for pair, _ in results], dtype="int64")
+
+    inter = gdf_ecosystem.iloc[pairs[:, 0]].reset_index(drop=True)
+    inter[gdf_ecosystem.geometry.name] = gpd.GeoSeries(
+        shapely.from_wkb([wkb for _, wkb in results]), crs=gdf_ecosystem.crs
+    )
+    return inter[gdf_ecosystem.columns], pairs
+
+
+def check_partitioned_overlay(
+    ecosystem_path: str,
+    mpa_path: str,
+    sample: int | None = 5,
+    rtol: float = 1e-6,
+    **kwargs,
+) -> dict:
+    """
+    Compare the partitioned engine with the original overlay.
+
+    Runs the partitioned engine twice (its output must be byte-identical) and,
+    per ecosystem feature, compares it with gpd.overlay of that feature: the
+    same number of rows, the same attributes, row areas within `rtol` and a
+    symmetric difference below `rtol` of the intersected area.
+
+    Parameters
+    ----------
+    ecosystem_path, mpa_path : str
+        Inputs, as for intersect_ecosystem_with_mpa.
+    sample : int or None, optional
+        Check only the first `sample` ecosystem features with candidates
+        (default: 5). If None, checks every feature (as slow as the overlay).
+    rtol : float, optional
+        Relative area tolerance (default: 1e-6).
+    **kwargs
+        Passed to partitioned_overlay.
+
+    Returns
+    -------
+    dict
+        'deterministic', 'features_checked' and 'mismatches' (list of
+        (ecosystem row, reason) tuples).
+    """
+
+    gdf_ecosystem = gpd.read_file(ecosystem_path).reset_index(drop=True)
+    gdf_mpa = gpd.read_file(mpa_path)
+    if gdf_mpa.crs != gdf_ecosystem.crs:
+        gdf_mpa = gdf_mpa.to_crs(gdf_ecosystem.crs)
+
+    if sample is not None:
+        hits = np.unique(STRtree(gdf_mpa.geometry.values).query(gdf_ecosystem.geometry.values, predicate="intersects")[0])
+        gdf_ecosystem = gdf_ecosystem.iloc[hits[:sample]].reset_index(drop=True)
+
+    first, pairs = partitioned_overlay(gdf_ecosystem, gdf_mpa, **kwargs)
+    second, _ = partitioned_overlay(gdf_ecosystem, gdf_mpa, **kwargs)
+    deterministic = first.to_wkb().equals(second.to_wkb())
+    print(f"Repeat runs identical: {deterministic}")
+
+    mismatches = []
+    attributes = [c for c in gdf_ecosystem.columns if c != gdf_ecosystem.geometry.name]
+    for e in range(len(gdf_ecosystem)):
+        ours = first.iloc[np.flatnonzero(pairs[:, 0] == e)] if len(pairs) else first
+        reference = overlay_reference(gdf_ecosystem.iloc[[e]], gdf_mpa)
+
+        if len(ours) != len(reference):
+            mismatches.append((e, f"{len(ours)} rows vs {len(reference)} from overlay"))
+            continue
+        if len(ours) == 0:
+            continue
+        if not np.array_equal(ours[attributes].astype(str).to_numpy(), reference[attributes].astype(str).to_numpy()):
+            mismatches.append((e, "attributes differ"))
+
+        our_areas = np.sort(ours.geometry.area.values)
+        reference_areas = np.sort(reference.geometry.area.values)
+        if not np.allclose(our_areas, reference_areas, rtol=rtol, atol=0):
+            mismatches.append((e, "row areas differ"))
+
+        difference = ours.geometry.unary_union.symmetric_difference(reference.geometry.unary_union).area
+        if difference > rtol * reference_areas.sum():
+            mismatches.append((e, f"symmetric difference {difference:.6g}"))
+
+    print(f"Checked {len(gdf_ecosystem)} ecosystem features against gpd.overlay: {len(mismatches)} mismatches")
+    for e, reason in mismatches:
+        print(f"  row {e}: {reason}")
+
+    return {
+        "deterministic": bool(deterministic),
+        "features_checked": len(gdf_ecosystem),
+        "mismatches": mismatches,
+    }
@@ -1,7 +1,187 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import rasterio
-from rasterio.features import shapes
+from rasterio.features import shapes, rasterize
+from rasterio.windows import Window, bounds as window_bounds
 import geopandas as gpd
-from shapely.geometry import shape
+from pyproj import Transformer
+from shapely import STRtree
+from shapely.geometry import shape, box
+
+
+# -------------------------------------------------------------------
+# Raster-native (windowed) helpers
+# -------------------------------------------------------------------
+# Per-process state for the block workers: the open raster, the vector
+# geometries with their spatial index, and the transformer to the area CRS
+_block_state = {}
+
+
+def _init_block_worker(raster_path, geometries, area_crs, polygons):
+    src = rasterio.open(raster_path)
+    _block_state.update(
+        src=src,
+        geometries=geometries,
+        tree=STRtree(geometries),
+        transformer=Transformer.from_crs(src.crs, area_crs, always_xy=True),
+        polygons=polygons,
+    )
+
+
+def _block_windows(width: int, height: int, block_size: int):
+    for row_off in range(0, height, block_size):
+        for col_off in range(0, width, block_size):
+            yield Window(
+                col_off,
+                row_off,
+                min(block_size, width - col_off),
+                min(block_size, height - row_off),
+            )
+
+
+def cell_areas(transform, shape: tuple, crs, transformer) -> np.ndarray:
+    """
+    Area of every cell of a raster grid, measured in an equal-area CRS.
+
+    Cell corners are projected with `transformer` and each cell's area is the
+    shoelace area of its projected corners. On an unrotated geographic grid a
+    cell's area depends only on its latitude, so one column is computed and
+    broadcast across the block.
+
+    Parameters
+    ----------
+    transform : affine.Affine
+        Transform of the grid (e.g. a window transform).
+    shape : tuple
+        (rows, cols) of the grid.
+    crs : rasterio.crs.CRS
+        CRS of the grid.
+    transformer : pyproj.Transformer
+        Transformer from `crs` to the equal-area CRS.
+
+    Returns
+    -------
+    numpy.ndarray
+        (rows, cols) array of cell areas (read-only if broadcast).
+    """
+    rows, cols = shape
+    if crs is not None and crs.is_geographic and transform.b == 0 and transform.d == 0:
+        return np.broadcast_to(cell_areas(transform, (rows, 1), None, transformer), shape)
+
+    col_idx, row_idx = np.meshgrid(np.arange(cols + 1), np.arange(rows + 1))
+    xs, ys = transform * (col_idx, row_idx)
+    px, py = transformer.transform(xs, ys)
+
+    # Corners of each cell, clockwise from the top-left
+    x0, y0 = px[:-1, :-1], py[:-1, :-1]
+    x1, y1 = px[:-1, 1:], py[:-1, 1:]
+    x2, y2 = px[1:, 1:], py[1:, 1:]
+    x3, y3 = px[1:, :-1], py[1:, :-1]
+    return 0.5 * np.abs(
+        (x0 * y1 - x1 * y0) + (x1 * y2 - x2 * y1) + (x2 * y3 - x3 * y2) + (x3 * y0 - x0 * y3)
+    )
+
+
+def _block_stats(window):
+    """Raster, vector and overlap area of one window (+ overlap polygons if requested)."""
+    src = _block_state["src"]
+    data = src.read(1, window=window)
+    transform = src.window_transform(window)
+
+    raster_mask = data > 0
+    if src.nodata is not None:
+        raster_mask &= (data != src.nodata)
+
+    # Burn only the vector geometries that touch this window
+    candidates = _block_state["tree"].query(box(*window_bounds(window, src.transform)))
+    if len(candidates):
+        vector_mask = rasterize(
+            ((_block_state["geometries"][i], 1) for i in candidates),
+            out_shape=data.shape,
+            transform=transform,
+            fill=0,
+            dtype="uint8",
+        ).astype(bool)
+    else:
+        vector_mask = np.zeros(data.shape, dtype=bool)
+
+    overlap = raster_mask & vector_mask
+    areas = cell_areas(transform, data.shape, src.crs, _block_state["transformer"])
+
+    polygons = []
+    if _block_state["polygons"] and overlap.any():
+        polygons = [
+            shape(geom)
+            for geom, _ in shapes(overlap.astype("uint8"), mask=overlap, transform=transform)
+        ]
+
+    return (
+        float(areas[raster_mask].sum()),
+        float(areas[vector_mask].sum()),
+        float(areas[overlap].sum()),
+        polygons,
+    )
+
+
+def _raster_native_stats(
+    raster_path: str,
+    poly_gdf: gpd.GeoDataFrame,
+    out_intersection: str | None,
+    area_crs: str,
+    block_size: int,
+    workers: int | None,
+    polygons: bool,
+):
+    with rasterio.open(raster_path) as src:
+        raster_crs = src.crs
+        width, height = src.width, src.height
+
+    if poly_gdf.crs != raster_crs:
+        poly_gdf = poly_gdf.to_crs(raster_crs)
+        print(f"Reprojected vectors to {raster_crs}")
+
+    geometries = [geom for geom in poly_gdf.geometry if geom is not None and not geom.is_empty]
+    windows = list(_block_windows(width, height, block_size))
+    workers = workers or os.cpu_count() or 1
+    print(f"Processing {len(windows)} blocks of up to {block_size}x{block_size} pixels on {workers} worker(s)")
+
+    raster_area = vector_area = result_area = 0.0
+    result_geoms = []
+    initargs = (raster_path, geometries, area_crs, polygons)
+
+    if workers == 1:
+        _init_block_worker(*initargs)
+        results = map(_block_stats, windows)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_block_worker, initargs=initargs
+        )
+        results = executor.map(_block_stats, windows, chunksize=max(1, len(windows) // (workers * 8)))
+
+    try:
+        for done, (block_raster, block_vector, block_result, block_polygons) in enumerate(results, start=1):
+            raster_area += block_raster
+            vector_area += block_vector
+            result_area += block_result
+            result_geoms.extend(block_polygons)
+            if done % 100 == 0 or done == len(windows):
+                print(f"  {done}/{len(windows)} blocks")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        else:
+            _block_state.pop("src").close()
+
+    # Overlap polygons are for display only; areas come from the cell weights above
+    result = gpd.GeoDataFrame(geometry=result_geoms, crs=raster_crs)
+    if polygons and out_intersection is not None:
+        result.to_file(out_intersection, driver="GeoJSON")
+        print(f"Saved intersection to {out_intersection}")
+
+    return result, raster_area, vector_area, result_area
 
 
 def raster_vector_intersection_stats(
@@ -11,11 +191,26 @@ def raster_vector_intersection_stats(
     out_raster_union: str | None = "raster_gt0_union.geojson",
     out_intersection: str | None = "raster_vector_intersection.geojson",
     area_crs: str = "ESRI:54009",
+    method: str = "polygon",
+    block_size: int = 2048,
+    workers: int | None = None,
+    polygons: bool = False,
 ):
     """
     Compute intersection between a raster mask (values > 0) and a vector layer,
     and print areas + percentage.
 
+    The "polygon" method polygonizes the raster mask and overlays it with the
+    vectors. The "raster" method never polygonizes the raster: it reads the
+    raster block by block, burns the vectors onto each block and sums per-pixel
+    equal-area cell weights, in parallel across blocks. Memory is bounded by the
+    block size, and a pixel counts as covered when its centre falls inside a
+    vector, so the overlap differs from the polygon method by edge pixels only.
+    The vector area is the burned pixel area too (no dissolve), so it only
+    covers the part of the vector layer inside the raster extent; it is returned
+    as 'vector_pixel_area' (and the percentage as 'pixel_percentage') so it is
+    not mistaken for the polygon method's dissolved area.
+
     Parameters
     ----------
     raster_path : str
@@ -31,13 +226,25 @@ def raster_vector_intersection_stats(
         Output path for the intersection polygons (GeoJSON). If None, not saved.
     area_crs : str, optional
         Equal-area CRS used to compute areas (default: ESRI:54009, Mollweide).
+    method : str, optional
+        "polygon" (default) or "raster".
+    block_size : int, optional
+        Block edge length in pixels for the "raster" method (default: 2048).
+    workers : int or None, optional
+        Worker processes for the "raster" method. If None, uses all CPUs.
+    polygons : bool, optional
+        "raster" method only: polygonize the overlap pixels for display and save
+        them to `out_intersection`. The raster union is never written.
 
     Returns
     -------
     result : geopandas.GeoDataFrame
-        Intersection GeoDataFrame.
+        Intersection GeoDataFrame (empty for the "raster" method unless
+        `polygons` is True).
     stats : dict
-        Dictionary with 'raster_area', 'vector_area', 'percentage'.
+        Dictionary with 'raster_area', 'vector_area', 'percentage' ("polygon"
+        method) or 'raster_area', 'vector_pixel_area', 'pixel_percentage'
+        ("raster" method).
     """
 
     # -------------------------------------------------------------------
@@ -49,6 +256,16 @@ def raster_vector_intersection_stats(
         poly_gdf = gpd.read_file(vector_path)
     print("Polygons read")
 
+    if method not in ("polygon", "raster"):
+        raise ValueError(f"Unknown method {method!r}; use 'polygon' or 'raster'.")
+
+    if method == "raster":
+        result, raster_area, vector_area, result_area = _raster_native_stats(
+            raster_path, poly_gdf, out_intersection, area_crs, block_size, workers, polygons
+        )
+        print(f"Raster mask area (>0): {raster_area:,.2f} (in {area_crs})")
+        return _summarize(result, raster_area, vector_area, result_area, area_crs, pixel_vector_area=True)
+
     # -------------------------------------------------------------------
     # 2. Build polygons from raster cells where raster > 0
     # -------------------------------------------------------------------
@@ -117,21 +334,44 @@ def raster_vector_intersection_stats(
     vector_diss_moll = vector_diss.to_crs(area_crs)
     vector_area = vector_diss_moll.geometry.area.iloc[0]
 
-    percentage_vector = (result_area / vector_area) * 100 if raster_area != 0 else float("nan")
-    percentage_raster = (result_area/raster_area)*100 #if raster_area != 0 else float("nan")
+    return _summarize(result, raster_area, vector_area, result_area, area_crs)
+
+
+def _summarize(result, raster_area, vector_area, result_area, area_crs, pixel_vector_area=False):
+    """
+    Print the summary and build the stats dict.
+
+    With `pixel_vector_area` (the "raster" method) the vector area is the area of
+    the burned pixels inside the raster, not the dissolved polygon area, so it and
+    the percentage are returned as 'vector_pixel_area' and 'pixel_percentage'
+    rather than under the polygon method's keys.
+    """
+
+    percentage_vector = (result_area / vector_area) * 100 if vector_area != 0 else float("nan")
+    percentage_raster = (result_area / raster_area) * 100 if raster_area != 0 else float("nan")
 
     # Print stats
-    print(f"Total dissolved vector area: {vector_area:,.2f} (in {area_crs})")
+    if pixel_vector_area:
+        print(f"Vector area (burned pixels inside the raster): {vector_area:,.2f} (in {area_crs})")
+    else:
+        print(f"Total dissolved vector area: {vector_area:,.2f} (in {area_crs})")
     print(f"Intersected area:{result_area}")
     print(f"Percentage of intersection area over total vector area: {percentage_vector:.2f}%")
     print(f"Percentage of vector intersection area over total raster area: {percentage_raster:.2f}%")
 
 
-    stats = {
-        "raster_area": float(raster_area),
-        "vector_area": float(vector_area),
-        "percentage": float(percentage_vector),
-    }
+    if pixel_vector_area:
+        stats = {
+            "raster_area": float(raster_area),
+            "vector_pixel_area": float(vector_area),
+            "pixel_percentage": float(percentage_vector),
+        }
+    else:
+        stats = {
+            "raster_area": float(raster_area),
+            "vector_area": float(vector_area),
+            "percentage": float(percentage_vector),
+        }
 
     return result, stats
 
@@ -155,6 +395,8 @@ def main():
     ).strip()
     out_intersection = out_intersection if out_intersection else None
 
+    method = input("Method (polygon/raster) [polygon]: ").strip() or "polygon"
+
     print("\nRunning analysis...\n")
 
     result, stats = raster_vector_intersection_stats(
@@ -163,6 +405,8 @@ def main():
         vector_layer=vector_layer,
         out_raster_union=out_raster_union,
         out_intersection=out_intersection,
+        method=method,
+        polygons=out_intersection is not None,
     )
 
     print("\n--- RESULTS ---")
@@ -0,0 +1,283 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+import rasterio.shutil
+import shapely
+from rasterio.features import rasterize
+from rasterio.transform import from_origin
+from rasterio.warp import calculate_default_transform
+from rasterio.windows import Window, bounds as window_bounds, transform as window_transform
+from shapely import STRtree
+
+
+# -------------------------------------------------------------------
+# Output grid
+# -------------------------------------------------------------------
+def output_grid(gdf: gpd.GeoDataFrame, pixel_size: float, dst_crs: str = "EPSG:4326"):
+    """
+    Grid with `pixel_size` cells (in the units of the GeoDataFrame's CRS) over
+    the layer's extent, expressed in `dst_crs`.
+
+    This is the grid the old rasterize-then-reproject path produced: the
+    pixel count is set in the layer's CRS and rasterio's default transform
+    carries it over to `dst_crs`, but no array is allocated.
+
+    Returns
+    -------
+    transform : affine.Affine
+    width, height : int
+    """
+    minx, miny, maxx, maxy = gdf.total_bounds
+    width = math.ceil((maxx - minx) / pixel_size)
+    height = math.ceil((maxy - miny) / pixel_size)
+
+    if gdf.crs == dst_crs:
+        return from_origin(minx, maxy, pixel_size, pixel_size), width, height
+
+    return calculate_default_transform(gdf.crs, dst_crs, width, height, minx, miny, maxx, maxy)
+
+
+# -------------------------------------------------------------------
+# Tile workers
+# -------------------------------------------------------------------
+# Per-process state: the vector geometries, their burn values and the
+# rasterize settings, sent once when the worker starts
+_tile_state = {}
+
+
+def _init_tile_worker(geometries_wkb, values, dtype, nodata, all_touched):
+    _tile_state.update(
+        geometries=shapely.from_wkb(geometries_wkb),
+        values=values,
+        dtype=dtype,
+        nodata=nodata,
+        all_touched=all_touched,
+    )
+
+
+def _rasterize_tile(window, transform, candidates):
+    values = _tile_state["values"]
+    tile_transform = window_transform(window, transform)
+    # Clip to the tile plus a one-pixel margin, so EEZ- or basin-sized polygons are not
+    # burned whole for every tile they cross and edge pixels burn as without clipping
+    minx, miny, maxx, maxy = window_bounds(window, transform)
+    margin_x, margin_y = abs(tile_transform.a), abs(tile_transform.e)
+    clipped = shapely.clip_by_rect(
+        _tile_state["geometries"][candidates],
+        minx - margin_x, miny - margin_y, maxx + margin_x, maxy + margin_y,
+    )
+    shapes = [(geometry, values[i]) for geometry, i in zip(clipped, candidates) if not geometry.is_empty]
+    if not shapes:
+        # The STRtree matches bounding boxes, so a candidate can miss the tile itself
+        return window, np.full((window.height, window.width), _tile_state["nodata"], dtype=_tile_state["dtype"])
+    array = rasterize(
+        shapes=shapes,
+        out_shape=(window.height, window.width),
+        transform=tile_transform,
+        fill=_tile_state["nodata"],
+        all_touched=_tile_state["all_touched"],
+        dtype=_tile_state["dtype"],
+    )
+    return window, array
+
+
+def _tile_windows(width: int, height: int, tile_size: int):
+    for row_off in range(0, height, tile_size):
+        for col_off in range(0, width, tile_size):
+            yield Window(
+                col_off,
+                row_off,
+                min(tile_size, width - col_off),
+                min(tile_size, height - row_off),
+            )
+
+
+# -------------------------------------------------------------------
+# Engine
+# -------------------------------------------------------------------
+def rasterize_tiled(
+    gdf: gpd.GeoDataFrame,
+    out_raster_path: str,
+    transform,
+    width: int,
+    height: int,
+    dst_crs: str = "EPSG:4326",
+    attribute: str | None = None,
+    nodata=0,
+    all_touched: bool = True,
+    tile_size: int = 2048,
+    workers: int | None = None,
+    compress: str = "deflate",
+    cog: bool = False,
+):
+    """
+    Rasterize a vector layer tile by tile straight onto a grid in `dst_crs`.
+
+    The vectors are reprojected (not the raster), each output tile burns only
+    the geometries an STRtree finds in its bounds, clipped to the tile, and
+    finished tiles are written into a tiled, compressed GeoTIFF as they arrive.
+    At most two tiles per worker are in flight, so peak memory depends on the
+    tile size and the vector layer, not on the raster size. Tiles with no
+    geometry are never computed and are left sparse (they read as `nodata`).
+
+    Parameters
+    ----------
+    gdf : geopandas.GeoDataFrame
+        Vector layer (any CRS).
+    out_raster_path : str
+        Output GeoTIFF path.
+    transform, width, height
+        Output grid in `dst_crs` (see output_grid).
+    dst_crs : str, optional
+        Output CRS (default: EPSG:4326).
+    attribute : str or None, optional
+        Column to burn (float32). If None, burns 1 (uint8).
+    nodata : int or float, optional
+        Fill / nodata value (default: 0).
+    all_touched : bool, optional
+        Burn every pixel touched by a geometry (default: True).
+    tile_size : int, optional
+        Tile edge in pixels; a multiple of 512 (default: 2048).
+    workers : int or None, optional
+        Worker processes. If None, uses all CPUs.
+    compress : str, optional
+        GeoTIFF compression (default: deflate).
+    cog : bool, optional
+        Convert the result to a Cloud Optimized GeoTIFF (default: False).
+    """
+
+    if tile_size % 512:
+        raise ValueError("tile_size must be a multiple of 512.")
+
+    # 1. Vectors in the output CRS, in their original burn order
+    gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+    if gdf.crs is not None and gdf.crs != dst_crs:
+        gdf = gdf.to_crs(dst_crs)
+
+    if attribute is not None:
+        values = gdf[attribute].to_numpy()
+        dtype = "float32"
+    else:
+        values = np.ones(len(gdf), dtype="uint8")
+        dtype = "uint8"
+
+    geometries = gdf.geometry.values
+    tree = STRtree(geometries)
+
+    # 2. Tiles with at least one candidate geometry
+    tasks = []
+    for window in _tile_windows(width, height, tile_size):
+        candidates = np.sort(tree.query(shapely.box(*window_bounds(window, transform))))
+        if len(candidates):
+            tasks.append((window, candidates))
+    n_tiles = math.ceil(width / tile_size) * math.ceil(height / tile_size)
+    print(f"Rasterizing {len(tasks)} of {n_tiles} tiles ({width}x{height} pixels)")
+
+    profile = {
+        "driver": "GTiff",
+        "height": height,
+        "width": width,
+        "count": 1,
+        "dtype": dtype,
+        "crs": dst_crs,
+        "transform": transform,
+        "nodata": nodata,
+        "tiled": True,
+        "blockxsize": 512,
+        "blockysize": 512,
+        "compress": compress,
+        "sparse_ok": True,
+        "BIGTIFF": "IF_SAFER",
+    }
+    tif_path = f"{out_raster_path}.tmp.tif" if cog else out_raster_path
+
+    # 3. Rasterize tiles in parallel and write each one as it finishes
+    initargs = (shapely.to_wkb(geometries), values, dtype, nodata, all_touched)
+    workers = workers or os.cpu_count() or 1
+
+    with rasterio.open(tif_path, "w", **profile) as dst:
+        if workers == 1:
+            _init_tile_worker(*initargs)
+            for done, (window, candidates) in enumerate(tasks, start=1):
+                dst.write(_rasterize_tile(window, transform, candidates)[1], 1, window=window)
+                if done % 50 == 0 or done == len(tasks):
+                    print(f"  {done}/{len(tasks)} tiles")
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_tile_worker, initargs=initargs) as executor:
+                pending = set()
+                next_task = 0
+                done = 0
+                while next_task < len(tasks) or pending:
+                    while next_task < len(tasks) and len(pending) < 2 * workers:
+                        window, candidates = tasks[next_task]
+                        pending.add(executor.submit(_rasterize_tile, window, transform, candidates))
+                        next_task += 1
+
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        window, array = future.result()
+                        dst.write(array, 1, window=window)
+                        done += 1
+                        if done % 50 == 0 or done == len(tasks):
+                            print(f"  {done}/{len(tasks)} tiles")
+
+    # 4. Optional COG (GDAL copies block by block)
+    if cog:
+        rasterio.shutil.copy(tif_path, out_raster_path, driver="COG", compress=compress, BIGTIFF="IF_SAFER")
+        os.remove(tif_path)
+
+    print(f"Raster written to {out_raster_path} with final CRS {dst_crs}")
+
+
+def vector_file_to_raster(
+    vector_path,
+    out_raster_path,
+    pixel_size_m=5000,
+    attribute=None,
+    target_crs=None,
+    nodata=0,
+    all_touched=True,
+    dst_crs="EPSG:4326",
+    tile_size=2048,
+    workers=None,
+    cog=False,
+):
+    """
+    Read a vector file and rasterize it to `dst_crs` with rasterize_tiled.
+
+    `pixel_size_m` is measured in `target_crs` (or the file's CRS if None), as
+    in the original rasterize-then-reproject utilities; the grid is then
+    expressed directly in `dst_crs`.
+    """
+
+    # --- allow large GeoJSON files ---
+    os.environ["OGR_GEOJSON_MAX_OBJ_SIZE"] = "0"
+
+    gdf = gpd.read_file(vector_path)
+
+    if gdf.empty:
+        raise ValueError("Shapefile has no features.")
+
+    if target_crs is not None:
+        gdf = gdf.to_crs(target_crs)
+
+    transform, width, height = output_grid(gdf, pixel_size_m, dst_crs)
+
+    rasterize_tiled(
+        gdf,
+        out_raster_path,
+        transform,
+        width,
+        height,
+        dst_crs=dst_crs,
+        attribute=attribute,
+        nodata=nodata,
+        all_touched=all_touched,
+        tile_size=tile_size,
+        workers=workers,
+        cog=cog,
+    )
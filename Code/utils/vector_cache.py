@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+import pyogrio
+
+
+# Bump when the cleaning steps below change, so old cache entries are not reused
+CACHE_VERSION = 1
+
+# Files that make up one shapefile; any of them changing changes the data
+SHAPEFILE_PARTS = (".shp", ".shx", ".dbf", ".prj", ".cpg")
+
+
+# -------------------------------------------------------------------
+# Source file hashes
+# -------------------------------------------------------------------
+def _file_hash(path: Path, memo: dict) -> str:
+    """BLAKE2 hash of a file, reused from `memo` while its size and mtime are unchanged."""
+    stat = path.stat()
+    key = str(path.resolve())
+    entry = memo.get(key)
+    if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+        return entry[2]
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(8 * 2**20), b""):
+            digest.update(chunk)
+    memo[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    return memo[key][2]
+
+
+def _source_files(path: Path) -> list:
+    if path.suffix.lower() == ".shp":
+        return [p for p in (path.with_suffix(ext) for ext in SHAPEFILE_PARTS) if p.exists()]
+    return [path]
+
+
+def _expand(paths) -> list:
+    if isinstance(paths, (str, Path)):
+        paths = [paths]
+    files = []
+    for pattern in paths:
+        matches = sorted(glob(str(pattern)))
+        if not matches:
+            raise FileNotFoundError(f"No vector files match {pattern}")
+        files.extend(Path(m) for m in matches)
+    return files
+
+
+# -------------------------------------------------------------------
+# Reading
+# -------------------------------------------------------------------
+def _read_shard(path, columns, where, bbox, to_crs, fix_geometries):
+    gdf = pyogrio.read_dataframe(path, columns=columns, where=where, bbox=bbox, use_arrow=True)
+    if to_crs is not None and gdf.crs is not None:
+        gdf = gdf.to_crs(to_crs)
+    if fix_geometries and len(gdf):
+        # Buffer trick fixes invalid polygons (points and lines are left alone)
+        polygonal = gdf.geom_type.isin(["Polygon", "MultiPolygon"])
+        gdf.loc[polygonal, "geometry"] = gdf.loc[polygonal, "geometry"].buffer(0)
+    return gdf
+
+
+def read_vectors_cached(
+    paths,
+    cache_dir: str = "vector_cache",
+    columns: list | None = None,
+    where: str | None = None,
+    bbox: tuple | None = None,
+    to_crs: str | None = None,
+    fix_geometries: bool = False,
+    workers: int | None = None,
+    refresh: bool = False,
+) -> gpd.GeoDataFrame:
+    """
+    Read one or more vector files through a GeoParquet cache.
+
+    Shards are read in parallel with pyogrio's Arrow reader, with the column
+    selection, attribute filter and bbox pushed down to GDAL so filtered-out
+    features are never parsed. The cleaned, reprojected result is sorted
+    along a Hilbert curve and saved as GeoParquet (with bbox covering
+    columns). The cache key is the hash of every source file plus the read
+    options, so later runs with the same inputs only read the Parquet file.
+
+    Parameters
+    ----------
+    paths : str, Path or list
+        Vector files or glob patterns (e.g. ".../*/*polygons.shp").
+    cache_dir : str, optional
+        Directory holding the GeoParquet files (default: "vector_cache").
+    columns : list or None, optional
+        Attribute columns to read. If None, reads all of them.
+    where : str or None, optional
+        OGR SQL attribute filter, e.g. "PA_DEF = '1' AND MARINE <> '0'".
+    bbox : tuple or None, optional
+        (minx, miny, maxx, maxy) in the source CRS.
+    to_crs : str or None, optional
+        Reproject to this CRS. If None, shards keep their CRS (they must match).
+    fix_geometries : bool, optional
+        Apply buffer(0) to polygons, as the notebooks do (default: False).
+    workers : int or None, optional
+        Reader threads. If None, one per file up to the CPU count.
+    refresh : bool, optional
+        Ignore any existing cache entry and rebuild it (default: False).
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+    """
+
+    files = _expand(paths)
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # -------------------------------------------------------------------
+    # 1. Cache key from source hashes + read options
+    # -------------------------------------------------------------------
+    memo_path = cache_dir / "file_hashes.json"
+    memo = json.loads(memo_path.read_text()) if memo_path.exists() else {}
+    sources = [
+        [str(part.name), _file_hash(part, memo)]
+        for path in files
+        for part in _source_files(path)
+    ]
+    memo_path.write_text(json.dumps(memo))
+
+    options = {
+        "version": CACHE_VERSION,
+        "sources": sources,
+        "columns": columns,
+        "where": where,
+        "bbox": list(bbox) if bbox is not None else None,
+        "to_crs": to_crs,
+        "fix_geometries": fix_geometries,
+    }
+    key = hashlib.blake2b(json.dumps(options, sort_keys=True).encode(), digest_size=16).hexdigest()
+    cache_path = cache_dir / f"{files[0].stem}-{key}.parquet"
+
+    if cache_path.exists() and not refresh:
+        gdf = gpd.read_parquet(cache_path)
+        print(f"Loaded {len(gdf)} features from cache {cache_path}")
+        return gdf
+
+    # -------------------------------------------------------------------
+    # 2. Parallel reads with filter pushdown
+    # -------------------------------------------------------------------
+    workers = workers or min(len(files), os.cpu_count() or 1)
+    print(f"Reading {len(files)} file(s) with {workers} thread(s)...")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        shards = list(executor.map(
+            lambda path: _read_shard(path, columns, where, bbox, to_crs, fix_geometries),
+            files,
+        ))
+
+    crs = shards[0].crs
+    if any(shard.crs != crs for shard in shards):
+        raise ValueError("Shards have different CRSs; pass to_crs to reproject them.")
+    gdf = gpd.GeoDataFrame(pd.concat(shards, ignore_index=True), crs=crs)
+
+    # -------------------------------------------------------------------
+    # 3. Spatial sort and write (atomically, so a crash never leaves a partial cache)
+    # -------------------------------------------------------------------
+    if len(gdf):
+        gdf = gdf.iloc[gdf.geometry.hilbert_distance().argsort()].reset_index(drop=True)
+
+    tmp_path = cache_path.with_suffix(".parquet.tmp")
+    gdf.to_parquet(tmp_path, index=False, write_covering_bbox=True)
+    os.replace(tmp_path, cache_path)
+    print(f"Cached {len(gdf)} features to {cache_path}")
+
+    return gdf
+
+
+def load_wdpa(
+    wdpa_dir: str,
+    shapetype: str | None = None,
+    area_crs: str = "ESRI:54009",
+    cache_dir: str = "vector_cache",
+    workers: int | None = None,
+):
+    """
+    Marine WDPA/WD-OECM polygons and points, as the Protect Spaces load_data step.
+
+    Parameters
+    ----------
+    wdpa_dir : str
+        Directory with the WDPA shard folders (each with *polygons.shp / *points.shp).
+    shapetype : str or None, optional
+        "MPA" (PA_DEF = '1'), "OECM" (PA_DEF = '0') or None for both.
+    area_crs : str, optional
+        CRS of the result (default: ESRI:54009, Mollweide).
+
+    Returns
+    -------
+    polygons, points : geopandas.GeoDataFrame
+    """
+
+    where = "MARINE <> '0'"
+    if shapetype == "MPA":
+        where += " AND PA_DEF = '1'"
+    elif shapetype == "OECM":
+        where += " AND PA_DEF = '0'"
+
+    layers = []
+    for kind in ("polygons", "points"):
+        layers.append(read_vectors_cached(
+            os.path.join(wdpa_dir, "*", f"*{kind}.shp"),
+            cache_dir=cache_dir,
+            where=where,
+            to_crs=area_crs,
+            fix_geometries=True,
+            workers=workers,
+        ))
+    return tuple(layers)
+
+
+def main():
+    print("\n--- Vector Ingest Cache ---")
+
+    paths = input("Vector file(s) or glob pattern(s), comma separated: ").strip()
+    where = input("Attribute filter (OGR SQL) — press Enter to skip: ").strip() or None
+    to_crs = input("Target CRS (e.g. ESRI:54009) — press Enter to keep: ").strip() or None
+    cache_dir = input("Cache directory [vector_cache]: ").strip() or "vector_cache"
+
+    gdf = read_vectors_cached(
+        [p.strip() for p in paths.split(",") if p.strip()],
+        cache_dir=cache_dir,
+        where=where,
+        to_crs=to_crs,
+    )
+
+    print(gdf.head())
+
+
+# Run the tool when executed as a script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rioxarray  # noqa: F401 - registers the .rio accessor
+import xarray as xr
+from pyproj import Transformer
+import shapely
+from rasterio.features import rasterize
+from rasterio.windows import Window, bounds as window_bounds, transform as window_transform
+from shapely import STRtree
+
+from raster_vector_intersections import cell_areas
+
+
+# Coordinate names normalised to the x/y names rioxarray expects
+SPATIAL_RENAMES = {"lon": "x", "lat": "y", "longitude": "x", "latitude": "y"}
+
+# Grid rows rasterized at a time; the ID buffer holds ROW_BLOCK x width int32 values
+ROW_BLOCK = 1024
+
+
+def _to_xy(da: xr.DataArray) -> xr.DataArray:
+    renames = {k: v for k, v in SPATIAL_RENAMES.items() if k in da.dims}
+    if renames:
+        da = da.rename(renames)
+    if da.rio.crs is None:
+        da = da.rio.write_crs("EPSG:4326")
+    return da
+
+
+def zonal_coverage(
+    features: gpd.GeoDataFrame,
+    flagged: xr.DataArray,
+    priority: xr.DataArray | None = None,
+    keep_columns: list | None = None,
+    area_crs: str = "ESRI:54009",
+    all_touched: bool = False,
+) -> gpd.GeoDataFrame:
+    """
+    Per-feature total, flagged and flagged-and-priority area without per-feature clips.
+
+    Feature IDs (EEZs, IHO seas, KBAs, ...) are rasterized onto the grid
+    of `flagged`, and every area is a weighted `np.bincount` over those IDs,
+    instead of clipping the raster once per feature. Overlapping features (e.g.
+    nested KBAs) are split into groups of non-overlapping features, each
+    rasterized on its own pass, so every feature gets its full area. IDs are
+    rasterized in blocks of ROW_BLOCK rows and only the covered pixels are kept.
+
+    Parameters
+    ----------
+    features : geopandas.GeoDataFrame
+        Zones to summarise. Reprojected to the grid CRS if needed.
+    flagged : xarray.DataArray
+        Flag or weight per pixel (e.g. risk level, dead-zone mask), with y/x
+        (or lat/lon) dims. Any other dims (band, time, ...) are reduced slice
+        by slice and give one output row per feature per slice. NaN counts as 0.
+    priority : xarray.DataArray or None, optional
+        Priority mask or weights (e.g. biodiversity priority areas). Matched to
+        the `flagged` grid by nearest neighbour. If None, the priority columns
+        are omitted.
+    keep_columns : list or None, optional
+        Feature attribute columns copied to the output (geometry is always kept).
+        If None, all columns are kept.
+    area_crs : str, optional
+        Equal-area CRS used for the cell areas (default: ESRI:54009, Mollweide).
+    all_touched : bool, optional
+        Assign every pixel touched by a feature rather than only pixels whose
+        centre falls inside it (default: False).
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        One row per feature (per slice for stacks) with 'total_area_km2',
+        'flagged_area_km2', 'flagged_percent' and, with a priority layer,
+        'flagged_priority_area_km2' and 'flagged_priority_percent'.
+    """
+
+    # -------------------------------------------------------------------
+    # 1. Grid, feature IDs and cell areas (computed once)
+    # -------------------------------------------------------------------
+    flagged = _to_xy(flagged)
+    grid_crs = flagged.rio.crs
+    transform = flagged.rio.transform()
+    shape = (flagged.sizes["y"], flagged.sizes["x"])
+
+    if features.crs != grid_crs:
+        features = features.to_crs(grid_crs)
+
+    n_bins = len(features) + 1
+    transformer = Transformer.from_crs(grid_crs, area_crs, always_xy=True)
+    grid_areas = cell_areas(transform, shape, grid_crs, transformer)
+    # On a geographic grid the areas are one latitude column broadcast across the
+    # grid; keep that column and index it by row rather than expanding it
+    row_areas = grid_areas[:, 0] / 1e6 if grid_areas.strides[1] == 0 else None
+
+    # One pass per group of non-overlapping features, rasterized in row blocks into
+    # one reused buffer, so peak memory does not grow with the grid or the pass count
+    passes = []
+    for inside, ids in _rasterize_groups(features.geometry.values, shape, transform, all_touched):
+        # Only pixels inside some feature take part in the reductions
+        if row_areas is not None:
+            areas = row_areas[inside // shape[1]]
+        else:
+            areas = np.asarray(grid_areas).ravel()[inside] / 1e6
+        passes.append({"inside": inside, "ids": ids, "areas": areas})
+
+    total_area = sum(np.bincount(p["ids"], weights=p["areas"], minlength=n_bins) for p in passes)[1:]
+    print(f"Rasterized {len(features)} features onto a {shape[0]}x{shape[1]} grid in {len(passes)} pass(es)")
+
+    if priority is not None:
+        priority = _to_xy(priority).squeeze(drop=True)
+        priority = priority.interp(x=flagged["x"], y=flagged["y"], method="nearest")
+        priority_values = np.nan_to_num(priority.values.astype("float64")).ravel()
+        for p in passes:
+            p["priority_areas"] = p["areas"] * priority_values[p["inside"]]
+        del priority_values
+
+    # -------------------------------------------------------------------
+    # 2. One bincount per band / time slice (and per pass)
+    # -------------------------------------------------------------------
+    if keep_columns is None:
+        keep_columns = [c for c in features.columns if c != features.geometry.name]
+    base = features[keep_columns + [features.geometry.name]].reset_index(drop=True)
+
+    extra_dims = [d for d in flagged.dims if d not in ("y", "x")]
+    flagged = flagged.transpose(*extra_dims, "y", "x")
+
+    tables = []
+    for index in np.ndindex(*[flagged.sizes[d] for d in extra_dims]):
+        layer = flagged.isel(dict(zip(extra_dims, index)))
+        values = np.nan_to_num(layer.values.astype("float64")).ravel()
+
+        table = base.copy()
+        for dim in extra_dims:
+            table[dim] = layer[dim].values.item() if dim in layer.coords else index[extra_dims.index(dim)]
+
+        flagged_area = np.zeros(n_bins)
+        flagged_priority_area = np.zeros(n_bins)
+        for p in passes:
+            weights = values[p["inside"]]
+            flagged_area += np.bincount(p["ids"], weights=p["areas"] * weights, minlength=n_bins)
+            if priority is not None:
+                flagged_priority_area += np.bincount(p["ids"], weights=p["priority_areas"] * weights, minlength=n_bins)
+
+        table["total_area_km2"] = total_area
+        table["flagged_area_km2"] = flagged_area[1:]
+        table["flagged_percent"] = _percent(flagged_area[1:], total_area)
+
+        if priority is not None:
+            table["flagged_priority_area_km2"] = flagged_priority_area[1:]
+            table["flagged_priority_percent"] = _percent(flagged_priority_area[1:], total_area)
+
+        tables.append(table)
+
+    return gpd.GeoDataFrame(pd.concat(tables, ignore_index=True), geometry=features.geometry.name, crs=features.crs)
+
+
+def _rasterize_groups(geometries, shape, transform, all_touched):
+    """
+    Flat indices of the pixels each group of non-overlapping features covers, and
+    the 1-based feature ID at each, as [(inside, ids)] (one entry per group).
+    """
+    groups = _overlap_free_groups(geometries)
+    group_of = np.full(len(geometries), -1)
+    for g, members in enumerate(groups):
+        group_of[members] = g
+
+    tree = STRtree(geometries)
+    height, width = shape
+    buffer = np.empty((min(ROW_BLOCK, height), width), dtype="int32")
+    parts = [([], []) for _ in groups]
+
+    for row_off in range(0, height, ROW_BLOCK):
+        window = Window(0, row_off, width, min(ROW_BLOCK, height - row_off))
+        candidates = np.sort(tree.query(shapely.box(*window_bounds(window, transform))))
+        candidates = candidates[group_of[candidates] >= 0]
+        block = buffer[:window.height]
+        for g in np.unique(group_of[candidates]):
+            block.fill(0)
+            rasterize(
+                ((geometries[i], i + 1) for i in candidates[group_of[candidates] == g]),
+                out=block,
+                transform=window_transform(window, transform),
+                all_touched=all_touched,
+            )
+            flat = block.ravel()
+            inside = np.flatnonzero(flat)
+            parts[g][0].append(inside + row_off * width)
+            parts[g][1].append(flat[inside])
+
+    return [
+        (np.concatenate(insides), np.concatenate(ids)) if insides
+        else (np.empty(0, dtype=np.int64), np.empty(0, dtype="int32"))
+        for insides, ids in parts
+    ]
+
+
+def _overlap_free_groups(geometries) -> list:
+    """
+    Split feature indices into groups whose members do not overlap (interiors
+    may not intersect; shared borders are fine), greedily in feature order.
+    Non-overlapping layers such as EEZs or IHO seas form a single group.
+    """
+    valid = [i for i, geom in enumerate(geometries) if geom is not None and not geom.is_empty]
+    tree = STRtree(geometries)
+    left, right = tree.query(geometries, predicate="intersects")
+    keep = (left != right)
+    left, right = left[keep], right[keep]
+    overlapping = ~shapely.touches(geometries[left], geometries[right])
+
+    neighbours = defaultdict(set)
+    for a, b in zip(left[overlapping].tolist(), right[overlapping].tolist()):
+        neighbours[a].add(b)
+
+    group_of = {}
+    groups = []
+    for i in valid:
+        taken = {group_of[j] for j in neighbours[i] if j in group_of}
+        g = next((g for g in range(len(groups)) if g not in taken), len(groups))
+        if g == len(groups):
+            groups.append([])
+        groups[g].append(i)
+        group_of[i] = g
+    return groups
+
+
+def _percent(part: np.ndarray, total: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total > 0, 100 * part / total, np.nan)
+
+
+def main():
+    print("\n--- Zonal Coverage Tool ---")
+
+    flagged_path = input("Enter flagged raster / NetCDF path: ").strip()
+    variable = input("Variable name (press Enter for a raster file): ").strip()
+    vector_path = input("Enter zones vector path (EEZ, IHO seas, KBA, ...): ").strip()
+    priority_path = input("Priority raster path — press Enter to skip: ").strip()
+    out_path = input("Output file (GeoJSON or .gpkg): ").strip()
+
+    if variable:
+        flagged = xr.open_dataset(flagged_path)[variable]
+    else:
+        flagged = rioxarray.open_rasterio(flagged_path, masked=True)
+    priority = rioxarray.open_rasterio(priority_path, masked=True) if priority_path else None
+    features = gpd.read_file(vector_path)
+
+    print("\nRunning analysis...\n")
+
+    result = zonal_coverage(features, flagged, priority)
+    result.to_file(out_path, driver="GeoJSON" if out_path.endswith("json") else "GPKG")
+    print(f"Saved {len(result)} rows to {out_path}")
+
+
+# Run the tool when executed as a script
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
+import time
+STARTUP_STARTED = time.monotonic()
+
 import openai
 import hashlib
-import pickle
+import json
 import os
+import threading
+
+import httpx
 
-from flask import Flask, request, jsonify
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from flask import Flask, Response, request, jsonify, stream_with_context
 from whoosh.index import open_dir
 from whoosh.qparser import MultifieldParser, OrGroup
 from whoosh import scoring
@@ -12,44 +19,292 @@ from langchain.vectorstores import Chroma
 from langchain.embeddings.openai import OpenAIEmbeddings
 from dotenv import load_dotenv
 from datetime import datetime
+from query_embeddings import QueryEmbeddingCache
+from cache_store import SQLiteCache
+from semantic_cache import SemanticCache
+from single_flight import SingleFlight
+from stage_cache import StageCache
+from scope_classifier import ScopeClassifier
+from openai_calls import AIMDLimiter, CallManager
+from vector_pack import VectorPack
+from lazy_stores import LazyStore, load_in_background
+from metrics import Metrics, RequestTimings, current_timings, submit_with_context
+from context_packing import (
+    get_encoding, content_key, reciprocal_rank_fusion, remove_near_duplicates, truncate_to_tokens, pack_snippets
+)
+from unified_index import CORPUS_DIRS, CORPUS_LABELS, tag_document, search_unified_index
+from whoosh_index import make_snippet
 
 load_dotenv()
 
+startup_timings = {"imports_seconds": round(time.monotonic() - STARTUP_STARTED, 3)}
+
+# Per-stage latency, token, cache and error metrics, exported on /metrics
+metrics = Metrics()
+metrics.describe("oc_stage_duration_seconds", "histogram", "Latency of each pipeline stage and OpenAI call.")
+metrics.describe("oc_stage_errors_total", "counter", "Exceptions raised by each pipeline stage.")
+metrics.describe("oc_retrieval_timeouts_total", "counter", "Retrieval sources dropped for missing their deadline.")
+metrics.describe("oc_openai_tokens_total", "counter", "OpenAI prompt and completion tokens by call.")
+metrics.describe("oc_openai_attempts_total", "counter", "OpenAI requests by call, role (primary or hedge) and outcome.")
+metrics.describe("oc_openai_retries_total", "counter", "OpenAI requests retried after a retryable error.")
+metrics.describe("oc_openai_hedges_total", "counter", "Hedged duplicate OpenAI requests sent.")
+metrics.describe("oc_openai_hedge_wins_total", "counter", "Hedged OpenAI calls by which request answered first.")
+metrics.describe("oc_openai_deadline_exceeded_total", "counter", "OpenAI calls abandoned at their deadline.")
+metrics.describe("oc_openai_limiter_rejections_total", "counter", "OpenAI calls that found no concurrency slot before their deadline.")
+metrics.describe("oc_openai_limiter_wait_seconds", "histogram", "Time OpenAI requests waited for a concurrency slot.")
+metrics.describe("oc_cache_requests_total", "counter", "Answer cache lookups by tier, result and source_used.")
+metrics.describe("oc_stage_cache_requests_total", "counter", "Stage cache lookups by stage and result.")
+metrics.describe("oc_scope_decisions_total", "counter", "Scope filter decisions by mode.")
+metrics.describe("oc_context_tokens_total", "counter", "Tokens in packed RAG contexts.")
+metrics.describe("oc_context_duplicate_tokens_total", "counter", "Snippet tokens removed from RAG contexts as duplicates.")
+metrics.describe("oc_fast_tier_total", "counter", "Fast-tier answers by result (rag, or fallback to the full pipeline).")
+metrics.describe("oc_requests_total", "counter", "Requests by endpoint and outcome.")
+
+# Send this header (any value) to /query to get a per-request stage timing breakdown
+DEBUG_TIMING_HEADER = "X-OC-Debug-Timing"
+METRICS_MIMETYPE = "text/plain; version=0.0.4"
+
 app = Flask(__name__)
 
 # Load OpenAI API key
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 openai.api_key = OPENAI_API_KEY
+# Optional API base URL (e.g. the local stand-in server used by benchmark/)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Shared, keep-alive HTTP connection pool for OpenAI calls
+OPENAI_POOL_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "200")),
+    max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "50")),
+    keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+)
+OPENAI_HTTP_TIMEOUT = httpx.Timeout(float(os.getenv("OPENAI_TIMEOUT", "120")), connect=5.0)
 
-# Load vector stores
-vector_store_oceanography = Chroma(
-    persist_directory="./data/oceanography_rag_db",
-    embedding_function=OpenAIEmbeddings(model="text-embedding-ada-002", openai_api_key=OPENAI_API_KEY)
+# Retries are done by the call manager below, not by the client
+client = OpenAI(
+    api_key=OPENAI_API_KEY,
+    base_url=OPENAI_BASE_URL,
+    http_client=httpx.Client(limits=OPENAI_POOL_LIMITS, timeout=OPENAI_HTTP_TIMEOUT),
+    max_retries=0
 )
 
-vector_store_ipcc = Chroma(
-    persist_directory="./data/oceans_rag_db",
-    embedding_function=OpenAIEmbeddings(model="text-embedding-ada-002", openai_api_key=OPENAI_API_KEY)
+# OpenAI call management: a deadline per call (seconds, retries included), jittered
+# retries on rate limits, timeouts, connection and 5xx errors, hedged duplicates of
+# calls slower than OPENAI_HEDGE_PERCENTILE of recent ones (0 disables hedging), and
+# an adaptive (AIMD) cap on concurrent requests per process. Web search calls are
+# not hedged, since each one is a billed search.
+OPENAI_CALL_POLICIES = {
+    "rag": {"deadline": float(os.getenv("OPENAI_DEADLINE_RAG", "30")), "hedge": True},
+    "web_search": {"deadline": float(os.getenv("OPENAI_DEADLINE_WEB_SEARCH", "60")), "hedge": False},
+    "web_review": {"deadline": float(os.getenv("OPENAI_DEADLINE_WEB_REVIEW", "60")), "hedge": False},
+    "consolidation": {"deadline": float(os.getenv("OPENAI_DEADLINE_CONSOLIDATION", "45")), "hedge": True},
+}
+OPENAI_CALL_SETTINGS = dict(
+    policies=OPENAI_CALL_POLICIES,
+    retries=int(os.getenv("OPENAI_MAX_RETRIES", "2")),
+    hedge_percentile=float(os.getenv("OPENAI_HEDGE_PERCENTILE", "95")),
 )
+OPENAI_LIMITER_SETTINGS = dict(
+    initial=int(os.getenv("OPENAI_CONCURRENCY_INITIAL", "32")),
+    min_limit=int(os.getenv("OPENAI_CONCURRENCY_MIN", "4")),
+    max_limit=int(os.getenv("OPENAI_CONCURRENCY_MAX", "256")),
+)
+openai_calls = CallManager(AIMDLimiter(**OPENAI_LIMITER_SETTINGS), metrics=metrics, **OPENAI_CALL_SETTINGS)
 
-vector_store_duarte = Chroma(
-    persist_directory="./data/duarte_rag_db",
-    embedding_function=OpenAIEmbeddings(model="text-embedding-ada-002", openai_api_key=OPENAI_API_KEY)
+# Shared query embeddings: one OpenAIEmbeddings client for every store, and each query
+# is embedded once per request (with a persisted LRU of recent query vectors)
+embeddings = OpenAIEmbeddings(
+    model="text-embedding-ada-002", openai_api_key=OPENAI_API_KEY, openai_api_base=OPENAI_BASE_URL
+)
+query_embedder = QueryEmbeddingCache(
+    embeddings,
+    cache_file=os.getenv("EMBEDDING_CACHE_FILE", "/tmp/query_embeddings.pkl"),
+    max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "5000"))
 )
 
-# Load Whoosh index
-WHOOSH_INDEX_DIR = 'index'
-ix = open_dir(WHOOSH_INDEX_DIR)
+# Vector stores and the whoosh index are opened lazily (in the background at startup,
+# or on first use), so the app accepts connections before they are loaded and a
+# missing store drops out of retrieval instead of crashing the process
+VECTOR_STORE_DIRS = CORPUS_DIRS
+WHOOSH_INDEX_DIR = os.getenv('WHOOSH_INDEX_DIR', 'index')
+
+# Optional single index over all three corpora (built with unified_index.py). When set,
+# one source-tagged search replaces the three per-corpus stores.
+UNIFIED_INDEX_DIR = os.getenv("UNIFIED_INDEX_DIR")
+# Set UNIFIED_GLOBAL_K to take a global top-k (at most 5 per corpus) instead of 5 per corpus
+UNIFIED_GLOBAL_K = int(os.getenv("UNIFIED_GLOBAL_K")) if os.getenv("UNIFIED_GLOBAL_K") else None
+
+# Optional memory-mapped vector packs (built with vector_pack.py). When set, each corpus is
+# searched from <VECTOR_PACK_DIR>/<corpus> instead of its Chroma store, and the vectors
+# are shared by every worker process on the host through the OS page cache.
+VECTOR_PACK_DIR = os.getenv("VECTOR_PACK_DIR")
+
+# "background" loads every store at startup; "lazy" waits for the first request that needs it
+STORE_LOADING = os.getenv("STORE_LOADING", "background")
+# Failed stores are reloaded from the readiness probe at most this often (seconds)
+STORE_RETRY_INTERVAL = float(os.getenv("STORE_RETRY_INTERVAL", "30"))
+
+def load_vector_store(persist_directory):
+    if not os.path.isdir(persist_directory):
+        raise FileNotFoundError(f"No Chroma store at {persist_directory}")
+    return Chroma(persist_directory=persist_directory, embedding_function=embeddings)
 
-# Simple local cache
-CACHE_FILE = "/tmp/query_cache.pkl"
-if os.path.exists(CACHE_FILE):
-    with open(CACHE_FILE, "rb") as f:
-        query_cache = pickle.load(f)
+if UNIFIED_INDEX_DIR:
+    stores = {"unified": LazyStore("unified", lambda: load_vector_store(UNIFIED_INDEX_DIR))}
+elif VECTOR_PACK_DIR:
+    stores = {
+        name: LazyStore(name, lambda name=name: VectorPack(os.path.join(VECTOR_PACK_DIR, name)))
+        for name in VECTOR_STORE_DIRS
+    }
 else:
-    query_cache = {}
+    stores = {
+        name: LazyStore(name, lambda persist_directory=persist_directory: load_vector_store(persist_directory))
+        for name, persist_directory in VECTOR_STORE_DIRS.items()
+    }
+stores["whoosh"] = LazyStore("whoosh", lambda: open_dir(WHOOSH_INDEX_DIR))
+
+# Answer cache: one SQLite (WAL) row per query, shared by all workers on the host
+CACHE_FILE = os.getenv("CACHE_FILE", "/tmp/query_cache.sqlite3")
+query_cache = SQLiteCache(CACHE_FILE, max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "50000")))
+
+def ttl_from_env(name, default):
+    """TTL in seconds from the environment; "none" means never expires."""
+    value = os.getenv(name, default)
+    return None if value.lower() == "none" else float(value)
+
+# Cache TTLs in seconds by source_used (None = never expires). Answers that include
+# web search are refreshed daily, RAG-only answers are kept indefinitely.
+WEB_SEARCH_CACHE_TTL = ttl_from_env("WEB_SEARCH_CACHE_TTL", "86400")
+CACHE_TTLS = {
+    "web_search": WEB_SEARCH_CACHE_TTL,
+    "rag + web_search": WEB_SEARCH_CACHE_TTL,
+    "rag": None,
+}
+
+# Stage cache: each pipeline stage is memoized in the answer cache under its own TTL
+# (0 = not memoized), so refreshing an expired answer only reruns the web branch and
+# the consolidation. Retrieval results are kept for a week, RAG answers indefinitely.
+stage_cache = StageCache(query_cache, {
+    "retrieval": ttl_from_env("STAGE_TTL_RETRIEVAL", "604800"),
+    "rag": ttl_from_env("STAGE_TTL_RAG", "none"),
+    "web_search": ttl_from_env("STAGE_TTL_WEB_SEARCH", str(WEB_SEARCH_CACHE_TTL)),
+    "web_review": ttl_from_env("STAGE_TTL_WEB_REVIEW", str(WEB_SEARCH_CACHE_TTL)),
+    "consolidation": ttl_from_env("STAGE_TTL_CONSOLIDATION", str(WEB_SEARCH_CACHE_TTL)),
+}, metrics)
+
+# Semantic cache: normalized questions indexed by embedding, pointing at answer cache keys
+stores["semantic_cache"] = LazyStore("semantic_cache", lambda: SemanticCache(
+    Chroma(
+        collection_name="semantic_cache",
+        persist_directory=os.getenv("SEMANTIC_CACHE_DIR", "./data/semantic_cache_db"),
+        embedding_function=embeddings,
+        collection_metadata={"hnsw:space": "cosine"}
+    ),
+    query_cache,
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.98")),
+    near_miss_margin=float(os.getenv("SEMANTIC_CACHE_NEAR_MISS_MARGIN", "0.03")),
+    candidates=int(os.getenv("SEMANTIC_CACHE_CANDIDATES", "5"))
+))
+
+# Local scope filter (centroids built with scope_classifier.py): "enforce" answers off-topic
+# questions before any retrieval or LLM call, "shadow" only logs and counts its decisions
+SCOPE_FILTER_MODE = os.getenv("SCOPE_FILTER_MODE", "off")
+if SCOPE_FILTER_MODE != "off":
+    stores["scope_filter"] = LazyStore("scope_filter", lambda: ScopeClassifier.load(
+        os.getenv("SCOPE_CENTROIDS_FILE", "./data/scope_centroids.npz"),
+        threshold=float(os.getenv("SCOPE_THRESHOLD", "0.75"))
+    ))
+
+# Optional warm-up: questions (JSON list, or one per line) run once the stores are loaded.
+# "retrieval" primes the embedding cache and store pages; "full" also fills the answer cache.
+WARMUP_QUERIES_FILE = os.getenv("WARMUP_QUERIES_FILE")
+WARMUP_MODE = os.getenv("WARMUP_MODE", "retrieval")
+warmup_status = {"state": "pending" if WARMUP_QUERIES_FILE else "disabled", "queries": 0, "failed": 0, "seconds": None}
+
+# Batch endpoint limits
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "500"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+# Coalesce concurrent identical queries (across threads and worker processes on this host)
+single_flight = SingleFlight(
+    lock_dir=os.getenv("SINGLE_FLIGHT_LOCK_DIR", "/tmp/oc_query_locks"),
+    wait_timeout=float(os.getenv("SINGLE_FLIGHT_TIMEOUT", "180"))
+)
+
+# Retrieval fan-out: every source runs concurrently and gets its own deadline (seconds).
+# A source that misses its deadline or raises is dropped from the context.
+RETRIEVAL_TIMEOUTS = {
+    "whoosh": float(os.getenv("RETRIEVAL_TIMEOUT_WHOOSH", "2")),
+    "oceanography": float(os.getenv("RETRIEVAL_TIMEOUT_OCEANOGRAPHY", "5")),
+    "ipcc": float(os.getenv("RETRIEVAL_TIMEOUT_IPCC", "5")),
+    "duarte": float(os.getenv("RETRIEVAL_TIMEOUT_DUARTE", "5")),
+    "unified": float(os.getenv("RETRIEVAL_TIMEOUT_UNIFIED", "5")),
+}
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("RETRIEVAL_WORKERS", "16")),
+    thread_name_prefix="retrieval"
+)
+
+# RAG context packing: whoosh and vector snippets are fused by reciprocal rank, near
+# duplicates removed, and the result packed into a token budget for the RAG prompt
+# (below the old 15 x 300-character vector context, about 1.1k tokens). Snippets keep
+# at least the old 300 characters: 100 tokens is about 400 characters of English
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "900"))
+CONTEXT_SNIPPET_MAX_TOKENS = int(os.getenv("CONTEXT_SNIPPET_MAX_TOKENS", "100"))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+encoding = get_encoding("gpt-4o")
+
+# Worker pool for the speculative LLM branches (web search + review) of concurrent requests
+llm_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("LLM_WORKERS", "32")),
+    thread_name_prefix="llm"
+)
+
+# Latency tiers for /query: "full" waits for the web branch and consolidation, "fast"
+# returns the RAG answer and finishes the full answer on this pool in the background
+QUERY_TIERS = ("full", "fast")
+background_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BACKGROUND_WORKERS", "8")),
+    thread_name_prefix="background"
+)
+# Flight keys with a background answer queued or running, so repeats are not queued again
+background_keys = set()
+background_keys_lock = threading.Lock()
+
+# Priority organizations for web search
+PRIORITY_DOMAINS = [
+    "un.org",                    # United Nations
+    "cbd.int",                   # Convention for Biological Diversity
+    "worldwildlife.org",         # WWF - World Wildlife Fund
+    "panda.org",                 # WWF alternative domain
+    "conservation.org",          # Conservation International
+    "nature.org",                # The Nature Conservancy
+    "imo.org",                   # International Maritime Organisation
+    "nationalgeographic.com",    # National Geographic
+    "nationalgeographic.org",    # National Geographic (org)
+    "springernature.com",        # Springer Nature
+    "springer.com",              # Springer
+    "nature.com",                # Journal of Nature
+    "nasa.gov",                  # NASA - North American Space Agency
+    "esa.int",                   # ESA - European Space Agency
+    "noaa.gov",                  # NOAA - National Oceanic and Atmospheric Administration
+    "cites.org",                 # CITES - Convention on International Trade in Endangered Species
+    "cms.int",                   # CMS - Convention on the Conservation of Migratory Species
+    "pewtrusts.org",             # PEW - PEW Charitable Trusts
+    "fao.org",                   # FAO - Food and Agriculture Organization
+    "unesco.org",                # UNESCO-IOC - Intergovernmental Oceanographic Commission of UNESCO
+    "ioc.unesco.org",            # UNESCO-IOC specific
+    "ices.dk",                   # ICES - International Council for the Exploration of the Sea
+    "iwc.int",                   # IWC - International Whaling Commission
+    "isa.org.jm",                # ISA - International Seabed Authority
+    "worldbank.org",             # World Bank
+]
+
+# Phrase the RAG prompt asks the model to use when the snippets cannot answer the question
+NO_CLEAR_ANSWER = "the snippets do not provide a clear answer to your question"
+# Answer the prompts (and the scope filter) give to questions unrelated to marine science
+OUT_OF_SCOPE_ANSWER = "This question is outside of my scope. Please ask something related to marine science or ocean-related topics."
 
 STOPWORDS = {"how", "does", "is", "the", "a", "an", "to", "of", "on", "in", "for", "with", "at", "by", "about"}
 
@@ -59,6 +314,9 @@ def preprocess_query(query):
     return " ".join(filtered_words)
 
 def cache_query(query, response):
+    if response["source_used"] == "scope_filter":
+        # Cheap to recompute, and not worth keeping if the threshold changes
+        return
     query_hash = hashlib.md5(query.encode()).hexdigest()
     
     # Add timestamp and search type
@@ -68,50 +326,174 @@ def cache_query(query, response):
         "source_used": response["source_used"]
     }
 
-    query_cache[query_hash] = response_with_metadata # Replaces any old versions of the query
+    ttl = CACHE_TTLS.get(response["source_used"])
     try:
-        with open(CACHE_FILE, "wb") as f:
-            pickle.dump(query_cache, f)
+        query_cache.set(query_hash, response_with_metadata, ttl=ttl) # Replaces any old versions of the query
     except Exception as e:
         print(f"Warning: Failed to write cache - {e}")
+        return
+
+    try:
+        normalized_query = preprocess_query(query)
+        stores["semantic_cache"].get().add(normalized_query, query_embedder.embed_query(normalized_query), query_hash)
+    except Exception as e:
+        print(f"Warning: Failed to update semantic cache - {e}")
 
 def get_cached_response(query):
     query_hash = hashlib.md5(query.encode()).hexdigest()
-    cached = query_cache.get(query_hash)
+    try:
+        with metrics.stage("cache_lookup"):
+            cached, status = query_cache.lookup(query_hash)
+    except Exception as e:
+        print(f"Warning: Failed to read cache - {e}")
+        return None
+    source_used = cached["source_used"] if cached else "none"
+    metrics.inc("oc_cache_requests_total", tier="exact", result=status, source_used=source_used)
+    return cached if status == "hit" else None # None if missing or expired
+
+def get_semantic_cached_response(query):
+    """Look up a cached answer to a paraphrase of `query` (see SemanticCache)."""
+    try:
+        with metrics.stage("semantic_cache_lookup"):
+            semantic_cache = stores["semantic_cache"].get()
+            normalized_query = preprocess_query(query)
+            # Embed the raw query in the same request, since retrieval needs it on a miss
+            normalized_embedding, _ = query_embedder.embed_queries([normalized_query, query])
+            cached, _ = semantic_cache.lookup(normalized_embedding)
+    except Exception as e:
+        print(f"Warning: Semantic cache unavailable - {e}")
+        return None
+    metrics.inc(
+        "oc_cache_requests_total", tier="semantic", result="hit" if cached else "miss",
+        source_used=cached["source_used"] if cached else "none"
+    )
     return cached
 
+def lookup_cached_response(query):
+    return get_cached_response(query) or get_semantic_cached_response(query)
+
+def flight_key(query):
+    # Identical questions are coalesced on their normalized form
+    return hashlib.md5(preprocess_query(query).encode()).hexdigest()
+
 def search_whoosh(query, top_n=5, snippet_length=300):
     query = preprocess_query(query)
+    ix = stores["whoosh"].get()
     with ix.searcher(weighting=scoring.BM25F()) as searcher:
         parser = MultifieldParser(["title", "content"], ix.schema, group=OrGroup)
         parsed_query = parser.parse(query)
         results = searcher.search(parsed_query, limit=top_n)
         search_results = []
         for result in results:
-            full_content = result["content"]
-            snippet = full_content[:snippet_length]
-            if len(full_content) > snippet_length:
-                last_period = snippet.rfind(". ")
-                if last_period != -1:
-                    snippet = snippet[:last_period + 1]
+            fields = result.fields()
+            # Indexes built by whoosh_index.py store the snippet; older ones store the full content
+            snippet = fields.get("snippet")
+            if snippet is None:
+                snippet = make_snippet(fields.get("content", ""), snippet_length)
             search_results.append({
-                "url": result["url"],
-                "title": result["title"],
-                "snippet": snippet.strip() + "..." if len(full_content) > snippet_length else snippet.strip()
+                "url": fields["url"],
+                "title": fields["title"],
+                "snippet": snippet
             })
     return search_results
 
-def generate_openai_response(context, user_query, model="gpt-4o", max_tokens=500):
-    response = client.chat.completions.create(
+def search_vector_store(vector_store, query_embedding, corpus, k=5):
+    return [tag_document(doc, corpus) for doc in vector_store.similarity_search_by_vector(query_embedding, k=k)]
+
+def vector_searches(get_embedding):
+    """
+    Map each vector retrieval source to a zero-argument search function: one per
+    corpus store, or a single "unified" search when UNIFIED_INDEX_DIR is set.
+    """
+    if UNIFIED_INDEX_DIR:
+        return {
+            "unified": lambda: search_unified_index(stores["unified"].get(), get_embedding(), global_k=UNIFIED_GLOBAL_K)
+        }
+    return {
+        name: lambda name=name: search_vector_store(stores[name].get(), get_embedding(), name)
+        for name in VECTOR_STORE_DIRS
+    }
+
+def split_unified_results(results):
+    """Replace a "unified" retrieval result with per-corpus entries."""
+    if "unified" in results:
+        unified = results.pop("unified") or {}
+        for name in VECTOR_STORE_DIRS:
+            results[name] = unified.get(name, [])
+    return results
+
+def retrieve_all_sources(user_query, dropped=None):
+    """
+    Search whoosh and the vector stores concurrently.
+
+    The query is embedded once, in parallel with the whoosh search, and the same
+    vector is reused for every Chroma search. Returns a dict with "whoosh" and one
+    entry per corpus. All deadlines are measured from the same start, so total
+    retrieval time follows the slowest source that answers in time. Sources that
+    time out or fail come back as empty lists, and are appended to `dropped` if given.
+    """
+    start = time.monotonic()
+    embedding_future = submit_with_context(
+        retrieval_executor, metrics.timed("embedding", lambda: query_embedder.embed_query(user_query))
+    )
+
+    searches = {"whoosh": lambda: search_whoosh(user_query)}
+    searches.update(vector_searches(embedding_future.result))
+
+    # Vector search timings include waiting for the shared query embedding
+    futures = {
+        name: submit_with_context(retrieval_executor, metrics.timed(f"retrieval_{name}", search))
+        for name, search in searches.items()
+    }
+
+    results = {}
+    for name, future in futures.items():
+        remaining = RETRIEVAL_TIMEOUTS[name] - (time.monotonic() - start)
+        try:
+            results[name] = future.result(timeout=max(remaining, 0))
+        except FuturesTimeoutError:
+            future.cancel()
+            metrics.inc("oc_retrieval_timeouts_total", source=name)
+            print(f"Warning: {name} retrieval missed its {RETRIEVAL_TIMEOUTS[name]}s deadline - dropping source")
+            results[name] = []
+            if dropped is not None:
+                dropped.append(name)
+        except Exception as e:
+            print(f"Warning: {name} retrieval failed - {e}")
+            results[name] = []
+            if dropped is not None:
+                dropped.append(name)
+    return split_unified_results(results)
+
+def record_usage(call, usage):
+    if usage is not None:
+        metrics.inc("oc_openai_tokens_total", usage.prompt_tokens, call=call, kind="prompt")
+        metrics.inc("oc_openai_tokens_total", usage.completion_tokens, call=call, kind="completion")
+
+def complete(request_kwargs, call):
+    """
+    Run a chat completion built by one of the *_request() helpers and return its text.
+    `call` names the call in metrics (rag, web_search, web_review, consolidation).
+    """
+    with metrics.stage(f"openai_{call}"):
+        response = openai_calls.call(
+            call, lambda timeout: client.chat.completions.create(**request_kwargs, timeout=timeout)
+        )
+    record_usage(call, response.usage)
+    return response.choices[0].message.content.strip()
+
+def rag_request(context, user_query, model="gpt-4o", max_tokens=500):
+    return dict(
         model=model,
         messages=[
             {
                 "role": "system",
                 "content": """
-                    You are a helpful assistant answering user questions using context snippets from three sources:
+                    You are a helpful assistant answering user questions using context snippets from four sources:
                     1. Ocean Studies -- Introduction to Oceanography by Segar et al.
                     2. IPCC reports.
                     3. Carlos Duarte scientific papers.
+                    4. Ocean Central website articles.
 
                     If the snippets clearly contain the answer to the user's question, answer it directly and concisely using language that's accessible to a broad audience. Reference the relevant snippet numbers to support your answer (e.g., "As stated in Snippet 2...").
 
@@ -137,39 +519,12 @@ def generate_openai_response(context, user_query, model="gpt-4o", max_tokens=500
         temperature=0.8,
         max_tokens=max_tokens
     )
-    return response.choices[0].message.content.strip()
 
-def generate_openai_response_with_web_search(user_query, model="gpt-4o-mini-search-preview", max_tokens=500):
-    # Priority organizations for web search
-    priority_domains = [
-        "un.org",                    # United Nations
-        "cbd.int",                   # Convention for Biological Diversity
-        "worldwildlife.org",         # WWF - World Wildlife Fund
-        "panda.org",                 # WWF alternative domain
-        "conservation.org",          # Conservation International
-        "nature.org",                # The Nature Conservancy
-        "imo.org",                   # International Maritime Organisation
-        "nationalgeographic.com",    # National Geographic
-        "nationalgeographic.org",    # National Geographic (org)
-        "springernature.com",        # Springer Nature
-        "springer.com",              # Springer
-        "nature.com",                # Journal of Nature
-        "nasa.gov",                  # NASA - North American Space Agency
-        "esa.int",                   # ESA - European Space Agency
-        "noaa.gov",                  # NOAA - National Oceanic and Atmospheric Administration
-        "cites.org",                 # CITES - Convention on International Trade in Endangered Species
-        "cms.int",                   # CMS - Convention on the Conservation of Migratory Species
-        "pewtrusts.org",             # PEW - PEW Charitable Trusts
-        "fao.org",                   # FAO - Food and Agriculture Organization
-        "unesco.org",                # UNESCO-IOC - Intergovernmental Oceanographic Commission of UNESCO
-        "ioc.unesco.org",            # UNESCO-IOC specific
-        "ices.dk",                   # ICES - International Council for the Exploration of the Sea
-        "iwc.int",                   # IWC - International Whaling Commission
-        "isa.org.jm",                # ISA - International Seabed Authority
-        "worldbank.org",             # World Bank
-    ]
+def generate_openai_response(context, user_query, model="gpt-4o", max_tokens=500):
+    return complete(rag_request(context, user_query, model, max_tokens), "rag")
 
-    response = client.chat.completions.create(
+def web_search_request(user_query, model="gpt-4o-mini-search-preview", max_tokens=500):
+    return dict(
         model=model,
         messages=[
             {
@@ -212,42 +567,15 @@ def generate_openai_response_with_web_search(user_query, model="gpt-4o-mini-sear
             }
         ],
         web_search_options={
-            "allowed_domains": priority_domains
+            "allowed_domains": PRIORITY_DOMAINS
         }
     )
-    return response.choices[0].message.content.strip()
 
-def review_web_search_response(openai_response, model="gpt-4o-mini-search-preview", max_tokens=500):
-    # Priority organizations for web search
-    priority_domains = [
-        "un.org",                    # United Nations
-        "cbd.int",                   # Convention for Biological Diversity
-        "worldwildlife.org",         # WWF - World Wildlife Fund
-        "panda.org",                 # WWF alternative domain
-        "conservation.org",          # Conservation International
-        "nature.org",                # The Nature Conservancy
-        "imo.org",                   # International Maritime Organisation
-        "nationalgeographic.com",    # National Geographic
-        "nationalgeographic.org",    # National Geographic (org)
-        "springernature.com",        # Springer Nature
-        "springer.com",              # Springer
-        "nature.com",                # Journal of Nature
-        "nasa.gov",                  # NASA - North American Space Agency
-        "esa.int",                   # ESA - European Space Agency
-        "noaa.gov",                  # NOAA - National Oceanic and Atmospheric Administration
-        "cites.org",                 # CITES - Convention on International Trade in Endangered Species
-        "cms.int",                   # CMS - Convention on the Conservation of Migratory Species
-        "pewtrusts.org",             # PEW - PEW Charitable Trusts
-        "fao.org",                   # FAO - Food and Agriculture Organization
-        "unesco.org",                # UNESCO-IOC - Intergovernmental Oceanographic Commission of UNESCO
-        "ioc.unesco.org",            # UNESCO-IOC specific
-        "ices.dk",                   # ICES - International Council for the Exploration of the Sea
-        "iwc.int",                   # IWC - International Whaling Commission
-        "isa.org.jm",                # ISA - International Seabed Authority
-        "worldbank.org",             # World Bank
-    ]
+def generate_openai_response_with_web_search(user_query, model="gpt-4o-mini-search-preview", max_tokens=500):
+    return complete(web_search_request(user_query, model, max_tokens), "web_search")
 
-    response = client.chat.completions.create(
+def review_request(openai_response, model="gpt-4o-mini-search-preview", max_tokens=500):
+    return dict(
         model=model,
         messages=[
             {
@@ -280,94 +608,30 @@ def review_web_search_response(openai_response, model="gpt-4o-mini-search-previe
             }
         ],
         web_search_options={
-            "allowed_domains": priority_domains
+            "allowed_domains": PRIORITY_DOMAINS
         }
     )
-    return response.choices[0].message.content.strip()
-
 
-@app.route('/query', methods=['POST'])
-def query():
-    data = request.get_json()
-    user_query = data.get('query', '').strip()
-    if not user_query:
-        return jsonify({"error": "Query is required."}), 400
-
-    cached_response = get_cached_response(user_query)
-    if cached_response:
-        # Check for web search and date
-        if cached_response["timestamp"]:
-            if cached_response["source_used"] == "web_search":
-                cached_time = datetime.fromisoformat(cached_response["timestamp"])
-                if cached_time.date() == datetime.utcnow().date():
-                # If web search and from today, return cached response
-                    return jsonify(cached_response["response"])
-                else:
-                    pass
-            else:
-                return jsonify(cached_response["response"])
-        else:
-            return jsonify(cached_response["response"])
-        
-
-    # === 1. Search Whoosh index ===
-    whoosh_results = search_whoosh(user_query)
-    oc_links = []
-    whoosh_summary = "**Ocean Central Results:**\n"
-    for res in whoosh_results:
-        oc_links.append({"title": res['title'], "url": res['url']})
-        whoosh_summary += f"- [{res['title']}]({res['url']})\n  Snippet: {res['snippet']}\n"
-
-    # === 2. Search vector stores
-    retriever_oceanography = vector_store_oceanography.as_retriever(search_kwargs={"k": 5})
-    retriever_ipcc = vector_store_ipcc.as_retriever(search_kwargs={"k": 5})
-    retriever_duarte = vector_store_duarte.as_retriever(search_kwargs={"k": 5})
-
-    oceanography_results = retriever_oceanography.get_relevant_documents(user_query)
-    ipcc_results = retriever_ipcc.get_relevant_documents(user_query)
-    duarte_results = retriever_duarte.get_relevant_documents(user_query)
-
-    combined_results = oceanography_results + ipcc_results + duarte_results
-
-    combined_summary = "**Oceanography, IPCC, and Duarte Paper Results:**\n"
-    structured_snippets = []
-    for i, doc in enumerate(combined_results, 1):
-        snippet = doc.page_content.strip()
-        source = (
-            "Segar et al. (2018)" if doc in oceanography_results else
-            "IPCC" if doc in ipcc_results else
-            "Duarte"
-        )
-        if doc in oceanography_results:
-            doc.metadata["source"] = "Segar et al. (2018)"
-            doc.metadata["title"] = "Ocean Studies - Introduction to Oceanography Fourth Edition"
-        
-        combined_summary += f"- Snippet {i} ({source}): {snippet[:300]}{'...' if len(snippet) > 300 else ''}\n"
-        structured_snippets.append({
-            "snippet_number": i,
-            "source": f"{doc.metadata.get('source', '')}, {doc.metadata.get('title', '')}, Page {doc.metadata.get('page', 'N/A')}"
-        })
+def review_web_search_response(openai_response, model="gpt-4o-mini-search-preview", max_tokens=500):
+    return complete(review_request(openai_response, model, max_tokens), "web_review")
 
-    # === 3. Try RAG response ===
-    openai_response = generate_openai_response(combined_summary, user_query)
 
-    if "the snippets do not provide a clear answer to your question" in openai_response.lower():
-        # Fallback: Use web search only
-        web_response_raw = generate_openai_response_with_web_search(user_query)
-        openai_response = review_web_search_response(web_response_raw)
-        source_used = "web_search"
-    else:
-        # Combine: Use both RAG and web search responses
-        web_response_raw = generate_openai_response_with_web_search(user_query)
-        web_response_clean = review_web_search_response(web_response_raw)
+def generate_reviewed_web_search_response(user_query):
+    web_response_raw = stage_cache.memoize(
+        "web_search", lambda: generate_openai_response_with_web_search(user_query), user_query
+    )
+    return stage_cache.memoize(
+        "web_review", lambda: review_web_search_response(web_response_raw), web_response_raw
+    )
 
-        # Consolidate RAG and web search answers using GPT
-        consolidation_prompt = f"""
+def consolidation_request(user_query, rag_response, web_response):
+    # Consolidate RAG and web search answers using GPT
+    consolidation_prompt = f"""
         You are a marine science assistant. The user asked: "{user_query}"
 
         You have two answers:
-        1. From retrieved documents (RAG): {openai_response}
-        2. From a real-time web search: {web_response_clean}
+        1. From retrieved documents (RAG): {rag_response}
+        2. From a real-time web search: {web_response}
 
         Keep the citations from both the RAG and web search answers. 
         Instead of saying “According to retrieved documents,” reference the sources, either broadly (e.g., “According to leading marine scientists”) or specifically (e.g., “According to research published in 2020”). 
@@ -375,32 +639,579 @@ def query():
         Still include snippet numbers from the RAG response (e.g., "As stated in Snippet 2...").
 
         """
+    return dict(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant for ocean and marine science."},
+            {"role": "user", "content": consolidation_prompt}
+        ],
+        temperature=0.7,
+        max_tokens=700
+    )
 
-        final_response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant for ocean and marine science."},
-                {"role": "user", "content": consolidation_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=700
+def consolidate_responses(user_query, rag_response, web_response):
+    return stage_cache.memoize(
+        "consolidation",
+        lambda: complete(consolidation_request(user_query, rag_response, web_response), "consolidation"),
+        user_query, rag_response, web_response
+    )
+
+def stream_consolidated_response(user_query, rag_response, web_response):
+    """Same as consolidate_responses, but yields answer tokens as they arrive."""
+    cached = stage_cache.get("consolidation", user_query, rag_response, web_response)
+    if cached is not None:
+        yield cached
+        return
+
+    tokens = []
+    with metrics.stage("openai_consolidation"):
+        # Deadline, retries and the concurrency limit apply until the stream opens; streams are not hedged
+        stream = openai_calls.call("consolidation", lambda timeout: client.chat.completions.create(
+            **consolidation_request(user_query, rag_response, web_response),
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=timeout
+        ), hedge=False)
+        for chunk in stream:
+            if chunk.usage is not None:
+                record_usage("consolidation", chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                tokens.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+    stage_cache.set("consolidation", "".join(tokens).strip(), user_query, rag_response, web_response)
+
+def build_context(retrieved):
+    """
+    Turn retrieve_all_sources() output into OC links, the RAG prompt context and
+    snippet metadata, plus a packing report (candidates, duplicates removed, context
+    tokens and the snippet tokens the removed duplicates would have used).
+    """
+    whoosh_results = retrieved["whoosh"]
+    oc_links = []
+    whoosh_candidates = []
+    for res in whoosh_results:
+        oc_links.append({"title": res['title'], "url": res['url']})
+        whoosh_candidates.append({
+            "id": content_key(res['snippet']),
+            "text": res['snippet'],
+            "label": "Ocean Central",
+            "citation": f"Ocean Central, {res['title']}, {res['url']}"
+        })
+
+    # Documents are tagged with their corpus (and citation metadata) at retrieval time.
+    # Ids are content hashes, so a passage returned by several sources is fused into one
+    ranked_lists = [whoosh_candidates]
+    for corpus in VECTOR_STORE_DIRS:
+        ranked_lists.append([
+            {
+                "id": content_key(doc.page_content),
+                "text": doc.page_content.strip(),
+                "label": CORPUS_LABELS[corpus],
+                "citation": f"{doc.metadata.get('source', '')}, {doc.metadata.get('title', '')}, Page {doc.metadata.get('page', 'N/A')}"
+            }
+            for doc in retrieved[corpus]
+        ])
+
+    fused = reciprocal_rank_fusion(ranked_lists, k=RRF_K)
+    deduped = remove_near_duplicates(fused, threshold=CONTEXT_DEDUP_THRESHOLD)
+    packed, lines, _ = pack_snippets(
+        deduped, CONTEXT_TOKEN_BUDGET, CONTEXT_SNIPPET_MAX_TOKENS, encoding
+    )
+
+    combined_summary = "**Ocean Central, Oceanography, IPCC, and Duarte Paper Results:**\n" + "".join(lines)
+    structured_snippets = [
+        {"snippet_number": i, "source": candidate["citation"]}
+        for i, candidate in enumerate(packed, 1)
+    ]
+
+    # Savings from deduplication only (repeats merged by fusion plus near duplicates),
+    # each duplicate counted at the same per-snippet cut as the snippets that were kept
+    def snippet_tokens(candidates):
+        return sum(
+            len(encoding.encode(truncate_to_tokens(candidate["text"], CONTEXT_SNIPPET_MAX_TOKENS, encoding)))
+            for candidate in candidates
         )
+    all_candidates = [candidate for ranked in ranked_lists for candidate in ranked]
+    duplicate_tokens = snippet_tokens(all_candidates) - snippet_tokens(deduped)
+    context_tokens = len(encoding.encode(combined_summary))
+    packing_report = {
+        "candidates": len(all_candidates),
+        "duplicates_removed": len(all_candidates) - len(deduped),
+        "packed": len(packed),
+        "context_tokens": context_tokens,
+        "tokens_saved": duplicate_tokens
+    }
+    metrics.inc("oc_context_tokens_total", context_tokens)
+    metrics.inc("oc_context_duplicate_tokens_total", duplicate_tokens)
+
+    return oc_links, combined_summary, structured_snippets, packing_report
+
+def context_cache_inputs(user_query):
+    # Retrieval and packing settings are part of the key, so changing them does not serve stale contexts
+    return (user_query, UNIFIED_INDEX_DIR, UNIFIED_GLOBAL_K, VECTOR_PACK_DIR, CONTEXT_TOKEN_BUDGET,
+            CONTEXT_SNIPPET_MAX_TOKENS, CONTEXT_DEDUP_THRESHOLD, RRF_K)
+
+def pack_retrieved_context(user_query, retrieved, dropped):
+    """
+    build_context() for freshly retrieved results, memoized as the "retrieval" stage
+    unless a source was dropped. Returns (oc_links, combined_summary, structured_snippets).
+    """
+    with metrics.stage("context_packing"):
+        oc_links, combined_summary, structured_snippets, packing_report = build_context(retrieved)
+    print(
+        f"Context packing: {packing_report['packed']}/{packing_report['candidates']} snippets "
+        f"({packing_report['duplicates_removed']} duplicates), {packing_report['context_tokens']} tokens, "
+        f"{packing_report['tokens_saved']} saved by dedupe - {user_query!r}"
+    )
+    if not dropped:
+        stage_cache.set("retrieval", [oc_links, combined_summary, structured_snippets],
+                        *context_cache_inputs(user_query))
+    return oc_links, combined_summary, structured_snippets
+
+def retrieve_context(user_query):
+    """Memoized retrieval + context packing. Returns (oc_links, combined_summary, structured_snippets)."""
+    cached = stage_cache.get("retrieval", *context_cache_inputs(user_query))
+    if cached is not None:
+        return tuple(cached)
+    dropped = []
+    retrieved = retrieve_all_sources(user_query, dropped)
+    return pack_retrieved_context(user_query, retrieved, dropped)
+
+def generate_rag_response(combined_summary, user_query):
+    return stage_cache.memoize(
+        "rag", lambda: generate_openai_response(combined_summary, user_query), combined_summary, user_query
+    )
+
+def out_of_scope_response(user_query, get_embedding):
+    """
+    Run the local scope filter on the query embedding (from `get_embedding()`). Returns
+    the /query response for an off-topic question in "enforce" mode, else None. If the
+    filter or the embedding is unavailable, every question is let through.
+    """
+    if SCOPE_FILTER_MODE == "off":
+        return None
+    try:
+        with metrics.stage("scope_check"):
+            in_scope, similarity, corpus = stores["scope_filter"].get().classify(get_embedding())
+    except Exception as e:
+        print(f"Warning: Scope filter unavailable - {e}")
+        return None
+
+    metrics.inc("oc_scope_decisions_total", decision="in_scope" if in_scope else "out_of_scope", mode=SCOPE_FILTER_MODE)
+    if in_scope:
+        return None
+    print(f"Scope filter ({SCOPE_FILTER_MODE}): out of scope, similarity {similarity:.3f} to {corpus} - {user_query!r}")
+    if SCOPE_FILTER_MODE != "enforce":
+        return None
+    return {"answer": OUT_OF_SCOPE_ANSWER, "links": [], "snippets": [], "source_used": "scope_filter"}
+
+def run_query_pipeline(user_query, stream=False):
+    """
+    Run the full retrieval + LLM pipeline for an uncached query.
+
+    Yields (event, data) pairs as results become available: "links" and "snippets"
+    once retrieval finishes, "token" for pieces of the answer (consolidation tokens
+    are streamed from the API when `stream` is True), and finally "final" with the
+    /query response.
+    """
+    # === 0. Reject off-topic questions before any LLM call ===
+    # The query embedding is usually cached by the semantic cache lookup, and is reused by retrieval
+    rejected = out_of_scope_response(user_query, lambda: query_embedder.embed_query(user_query))
+    if rejected:
+        yield "links", rejected["links"]
+        yield "snippets", rejected["snippets"]
+        yield "token", rejected["answer"]
+        yield "final", rejected
+        return
+
+    # The web branch does not depend on retrieval or on the RAG answer, so start it
+    # speculatively right away. The RAG answer only decides whether consolidation runs.
+    web_future = submit_with_context(llm_executor, generate_reviewed_web_search_response, user_query)
+
+    # === 1. Search Whoosh index and vector stores concurrently ===
+    oc_links, combined_summary, structured_snippets = retrieve_context(user_query)
+    yield "links", oc_links
+    yield "snippets", structured_snippets
 
-        openai_response = final_response.choices[0].message.content.strip()
+    # === 2. Try RAG response ===
+    openai_response = generate_rag_response(combined_summary, user_query)
+    web_response_clean = web_future.result()
+
+    if NO_CLEAR_ANSWER in openai_response.lower():
+        # Fallback: Use web search only
+        openai_response = web_response_clean
+        source_used = "web_search"
+        yield "token", openai_response
+    elif stream:
+        # Combine: Use both RAG and web search responses, streaming the consolidation
+        tokens = []
+        for token in stream_consolidated_response(user_query, openai_response, web_response_clean):
+            tokens.append(token)
+            yield "token", token
+        openai_response = "".join(tokens).strip()
+        source_used = "rag + web_search"
+    else:
+        # Combine: Use both RAG and web search responses
+        openai_response = consolidate_responses(user_query, openai_response, web_response_clean)
         source_used = "rag + web_search"
 
-    # === 4. Build response ===
-    structured_response = {
+    # === 3. Build response ===
+    yield "final", {
         "answer": openai_response,
         "links": oc_links,
         "snippets": structured_snippets,
         "source_used": source_used
     }
 
-    # === 5. Cache it ===
-    cache_query(user_query, structured_response)
+def answer_query(user_query):
+    """Run the pipeline to completion and return the /query response."""
+    for event, data in run_query_pipeline(user_query):
+        if event == "final":
+            return data
+
+def answer_with_single_flight(user_query):
+    """
+    Answer an uncached query, or wait for an identical in-flight one.
+    Returns (response, coalesced).
+    """
+    with single_flight.flight(flight_key(user_query), lambda: lookup_cached_response(user_query)) as flight:
+        if flight.coalesced:
+            # An identical query finished while we waited
+            return flight.result["response"], True
+
+        structured_response = answer_query(user_query)
+
+        # === Cache it ===
+        cache_query(user_query, structured_response)
+        flight.set_result({"response": structured_response})
+        return structured_response, False
+
+def complete_in_background(user_query):
+    try:
+        answer_with_single_flight(user_query)
+    except Exception as e:
+        print(f"Warning: Background answer failed - {e}")
+    finally:
+        with background_keys_lock:
+            background_keys.discard(flight_key(user_query))
+
+def submit_background_answer(user_query):
+    """
+    Queue complete_in_background() unless this question is already queued or being
+    answered in this process; duplicates would only sit on the pool as single-flight
+    waiters and hold up background answers for other questions.
+    """
+    key = flight_key(user_query)
+    with background_keys_lock:
+        if key in background_keys or single_flight.in_flight(key):
+            return
+        background_keys.add(key)
+    background_executor.submit(complete_in_background, user_query)
+
+def answer_fast(user_query):
+    """
+    Fast tier: return the RAG answer with Ocean Central links without waiting for the
+    web search, review and consolidation. The full pipeline then runs in the
+    background (reusing the memoized retrieval and RAG stages) and caches the full
+    answer for later requests. Questions the snippets cannot answer need the web
+    answer, so they go through the full pipeline.
+    """
+    rejected = out_of_scope_response(user_query, lambda: query_embedder.embed_query(user_query))
+    if rejected:
+        return rejected
+
+    oc_links, combined_summary, structured_snippets = retrieve_context(user_query)
+    rag_response = generate_rag_response(combined_summary, user_query)
+    if NO_CLEAR_ANSWER in rag_response.lower():
+        metrics.inc("oc_fast_tier_total", result="fallback")
+        structured_response, _ = answer_with_single_flight(user_query)
+        return structured_response
+
+    metrics.inc("oc_fast_tier_total", result="rag")
+    submit_background_answer(user_query)
+    return {
+        "answer": rag_response,
+        "links": oc_links,
+        "snippets": structured_snippets,
+        "source_used": "rag"
+    }
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def with_timings(response, timings, served):
+    """
+    Attach the debug timing breakdown to a /query response, if one was requested, and
+    how it was served: "cache", "coalesced" (an identical in-flight query's answer)
+    or "computed".
+    """
+    if timings is None:
+        return response
+    return {**response, "timings": timings.as_dict(), "served": served}
+
+@app.route('/query', methods=['POST'])
+def query():
+    data = request.get_json()
+    user_query = data.get('query', '').strip()
+    if not user_query:
+        metrics.inc("oc_requests_total", endpoint="query", outcome="invalid")
+        return jsonify({"error": "Query is required."}), 400
+    tier = data.get('tier', 'full')
+    if tier not in QUERY_TIERS:
+        metrics.inc("oc_requests_total", endpoint="query", outcome="invalid")
+        return jsonify({"error": f"tier must be one of {', '.join(QUERY_TIERS)}."}), 400
+
+    timings = RequestTimings() if request.headers.get(DEBUG_TIMING_HEADER) else None
+    timings_token = current_timings.set(timings)
+    try:
+        with metrics.stage("request"):
+            cached_response = lookup_cached_response(user_query)
+            if cached_response:
+                metrics.inc("oc_requests_total", endpoint="query", outcome="cached")
+                return jsonify(with_timings(cached_response["response"], timings, "cache"))
+
+            coalesced = False
+            if tier == "fast":
+                structured_response = answer_fast(user_query)
+            else:
+                structured_response, coalesced = answer_with_single_flight(user_query)
+    except Exception:
+        metrics.inc("oc_requests_total", endpoint="query", outcome="error")
+        raise
+    finally:
+        current_timings.reset(timings_token)
+
+    metrics.inc("oc_requests_total", endpoint="query", outcome="answered")
+    return jsonify(with_timings(structured_response, timings, "coalesced" if coalesced else "computed"))
+
+@app.route('/query/stream', methods=['POST'])
+def query_stream():
+    """
+    Server-sent events variant of /query. Emits `links`, `snippets`, `token` and a
+    `final` event whose data has the same shape as the /query response. Cached
+    answers are sent immediately.
+    """
+    data = request.get_json()
+    user_query = data.get('query', '').strip()
+    if not user_query:
+        return jsonify({"error": "Query is required."}), 400
+
+    cached_response = lookup_cached_response(user_query)
+
+    def stream_cached(response):
+        yield sse_event("links", response["links"])
+        yield sse_event("snippets", response["snippets"])
+        yield sse_event("final", response)
+
+    def generate():
+        if cached_response:
+            yield from stream_cached(cached_response["response"])
+            return
+
+        with single_flight.flight(flight_key(user_query), lambda: lookup_cached_response(user_query)) as flight:
+            if flight.coalesced:
+                yield from stream_cached(flight.result["response"])
+                return
+
+            try:
+                for event, event_data in run_query_pipeline(user_query, stream=True):
+                    if event == "final":
+                        # Cache before the last write, in case the client disconnects
+                        cache_query(user_query, event_data)
+                        flight.set_result({"response": event_data})
+                    yield sse_event(event, event_data)
+            except Exception as e:
+                print(f"Warning: Streaming query failed - {e}")
+                yield sse_event("error", {"error": "Failed to answer query."})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/query/batch', methods=['POST'])
+def query_batch():
+    """
+    Answer many questions in one request. Duplicate questions are answered once,
+    cache misses are embedded in a single batched request, and the pipeline runs
+    with at most `concurrency` questions in flight. Results come back in input
+    order, each with its own status so one failure does not sink the batch.
+    """
+    data = request.get_json()
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not queries:
+        return jsonify({"error": "A non-empty list of queries is required."}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({"error": f"At most {BATCH_MAX_QUERIES} queries per batch."}), 400
+
+    try:
+        concurrency = int(data.get('concurrency', BATCH_MAX_CONCURRENCY))
+    except (TypeError, ValueError):
+        return jsonify({"error": "concurrency must be an integer."}), 400
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+
+    # === 1. Dedupe on the normalized query ===
+    user_queries = [q.strip() if isinstance(q, str) else "" for q in queries]
+    unique_queries = {}
+    for user_query in user_queries:
+        if user_query:
+            unique_queries.setdefault(flight_key(user_query), user_query)
+
+    # === 2. Exact cache, then one batched embedding request for the misses ===
+    results = {}
+    uncached = {}
+    for key, user_query in unique_queries.items():
+        cached_response = get_cached_response(user_query)
+        if cached_response:
+            results[key] = {"status": "cached", "response": cached_response["response"]}
+        else:
+            uncached[key] = user_query
+
+    if uncached:
+        texts = list(uncached.values())
+        try:
+            query_embedder.embed_queries(texts + [preprocess_query(text) for text in texts])
+        except Exception as e:
+            print(f"Warning: Batched embedding failed - {e}")
+
+    # === 3. Semantic cache + pipeline with bounded concurrency ===
+    def answer_item(user_query):
+        try:
+            cached_response = get_semantic_cached_response(user_query)
+            if cached_response:
+                return {"status": "cached", "response": cached_response["response"]}
+            structured_response, coalesced = answer_with_single_flight(user_query)
+            return {"status": "coalesced" if coalesced else "ok", "response": structured_response}
+        except Exception as e:
+            print(f"Warning: Batch query failed - {e}")
+            return {"status": "error", "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        futures = {key: executor.submit(answer_item, user_query) for key, user_query in uncached.items()}
+        for key, future in futures.items():
+            results[key] = future.result()
+
+    # === 4. Results in input order ===
+    items = []
+    for user_query in user_queries:
+        if not user_query:
+            items.append({"query": user_query, "status": "error", "error": "Query is required."})
+        else:
+            items.append({"query": user_query, **results[flight_key(user_query)]})
+
+    return jsonify({"results": items})
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "answer_cache_entries": len(query_cache),
+        "semantic_cache": (
+            stores["semantic_cache"].get().stats() if stores["semantic_cache"].state == "ready"
+            else stores["semantic_cache"].status()
+        ),
+        "embedding_cache": query_embedder.stats(),
+        "single_flight": single_flight.stats()
+    })
+
+def render_metrics(call_manager):
+    """
+    Prometheus text-format metrics for this worker process, with the OpenAI
+    concurrency gauges taken from `call_manager` (OC_asgi has its own).
+    """
+    for name, value in query_embedder.stats().items():
+        metrics.set("oc_embedding_cache", value, stat=name)
+    for name, value in single_flight.stats().items():
+        metrics.set("oc_single_flight", value, stat=name)
+    for name, value in call_manager.stats().items():
+        metrics.set("oc_openai_concurrency", value, stat=name)
+    if stores["semantic_cache"].state == "ready":
+        for name, value in stores["semantic_cache"].get().stats().items():
+            metrics.set("oc_semantic_cache", value, stat=name)
+    for name, store in stores.items():
+        metrics.set("oc_store_ready", 1 if store.state == "ready" else 0, store=name)
+    return metrics.render()
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text-format metrics for this worker process."""
+    return Response(render_metrics(openai_calls), mimetype=METRICS_MIMETYPE)
+
+def readiness():
+    """Return (is_ready, body) for the readiness probes of both serving modes."""
+    # A replica that is not ready gets no traffic, so failed stores are retried from here
+    for store in stores.values():
+        store.retry_in_background(STORE_RETRY_INTERVAL)
+    store_status = {name: store.status() for name, store in stores.items()}
+    # In lazy mode stores only load on first use, so "pending" is not a reason to hold traffic
+    ok_states = ("ready",) if STORE_LOADING == "background" else ("ready", "pending")
+    is_ready = (
+        all(status["state"] in ok_states for status in store_status.values())
+        and warmup_status["state"] in ("disabled", "done")
+    )
+    return is_ready, {
+        "ready": is_ready,
+        "stores": store_status,
+        "warmup": warmup_status,
+        "startup_timings": startup_timings
+    }
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once every store is loaded and warm-up has finished, else 503."""
+    is_ready, body = readiness()
+    return jsonify(body), 200 if is_ready else 503
+
+def load_warmup_queries(path):
+    with open(path) as f:
+        text = f.read()
+    try:
+        queries = json.loads(text)
+    except json.JSONDecodeError:
+        queries = text.splitlines()
+    return [q.strip() for q in queries if isinstance(q, str) and q.strip()]
+
+def run_warmup():
+    warmup_status["state"] = "running"
+    start = time.monotonic()
+    try:
+        queries = load_warmup_queries(WARMUP_QUERIES_FILE)
+    except Exception as e:
+        print(f"Warning: Failed to read warm-up queries - {e}")
+        queries = []
+
+    for user_query in queries:
+        try:
+            if WARMUP_MODE == "full":
+                if not lookup_cached_response(user_query):
+                    answer_with_single_flight(user_query)
+            else:
+                retrieve_all_sources(user_query)
+        except Exception as e:
+            warmup_status["failed"] += 1
+            print(f"Warning: Warm-up query failed - {e}")
+        warmup_status["queries"] += 1
+
+    warmup_status["seconds"] = round(time.monotonic() - start, 3)
+    warmup_status["state"] = "done"
+
+def finish_startup():
+    if WARMUP_QUERIES_FILE:
+        run_warmup()
+    startup_timings["ready_seconds"] = round(time.monotonic() - STARTUP_STARTED, 3)
+
+    report = ", ".join(
+        [f"imports {startup_timings['imports_seconds']}s", f"app init {startup_timings['app_init_seconds']}s"]
+        + [f"{name} {store.load_seconds}s ({store.state})" for name, store in stores.items() if store.load_seconds is not None]
+        + ([f"warm-up {warmup_status['seconds']}s ({warmup_status['queries']} queries)"] if WARMUP_QUERIES_FILE else [])
+    )
+    print(f"Startup timings: {report}; ready after {startup_timings['ready_seconds']}s")
 
-    return jsonify(structured_response)
+startup_timings["app_init_seconds"] = round(time.monotonic() - STARTUP_STARTED - startup_timings["imports_seconds"], 3)
+if STORE_LOADING == "background":
+    load_in_background(list(stores.values()), on_done=finish_startup)
+elif WARMUP_QUERIES_FILE:
+    threading.Thread(target=finish_startup, name="warmup", daemon=True).start()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,323 @@
+"""
+Async (ASGI) serving mode for the Ocean Central RAG API.
+
+Serves the same `/query` contract as OC_app.py, but requests wait on OpenAI as
+coroutines instead of holding a worker thread, so one process can keep hundreds of
+queries in flight. OpenAI calls go through a single AsyncOpenAI client with a
+shared keep-alive connection pool; whoosh and Chroma searches (which are
+synchronous libraries) run on OC_app's bounded retrieval thread pool.
+
+Run with an ASGI server, e.g.:
+
+    hypercorn OC_asgi:app --bind 0.0.0.0:5000 --workers 4
+"""
+import asyncio
+import contextvars
+
+import httpx
+
+from openai import AsyncOpenAI
+from openai_calls import AsyncAIMDLimiter, AsyncCallManager
+from quart import Quart, Response, request, jsonify
+
+from OC_app import (
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_POOL_LIMITS,
+    OPENAI_HTTP_TIMEOUT,
+    OPENAI_CALL_SETTINGS,
+    OPENAI_LIMITER_SETTINGS,
+    DEBUG_TIMING_HEADER,
+    METRICS_MIMETYPE,
+    RETRIEVAL_TIMEOUTS,
+    NO_CLEAR_ANSWER,
+    QUERY_TIERS,
+    retrieval_executor,
+    metrics,
+    RequestTimings,
+    current_timings,
+    with_timings,
+    readiness,
+    render_metrics,
+    record_usage,
+    query_embedder,
+    stores,
+    preprocess_query,
+    cache_query,
+    get_cached_response,
+    lookup_cached_response,
+    single_flight,
+    flight_key,
+    search_whoosh,
+    vector_searches,
+    split_unified_results,
+    stage_cache,
+    context_cache_inputs,
+    pack_retrieved_context,
+    out_of_scope_response,
+    rag_request,
+    web_search_request,
+    review_request,
+    consolidation_request,
+)
+
+app = Quart(__name__)
+
+async_client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    base_url=OPENAI_BASE_URL,
+    http_client=httpx.AsyncClient(limits=OPENAI_POOL_LIMITS, timeout=OPENAI_HTTP_TIMEOUT),
+    max_retries=0
+)
+# Same deadlines, retries, hedging and adaptive concurrency limit as OC_app's calls
+async_openai_calls = AsyncCallManager(
+    AsyncAIMDLimiter(**OPENAI_LIMITER_SETTINGS), metrics=metrics, **OPENAI_CALL_SETTINGS
+)
+
+# In-process coalescing of identical queries: normalized query key -> answer task.
+# Each task also takes OC_app's SingleFlight lock, so identical queries are coalesced
+# across worker processes too
+in_flight = {}
+
+
+async def acomplete(request_kwargs, call):
+    with metrics.stage(f"openai_{call}"):
+        response = await async_openai_calls.call(
+            call, lambda timeout: async_client.chat.completions.create(**request_kwargs, timeout=timeout)
+        )
+    record_usage(call, response.usage)
+    return response.choices[0].message.content.strip()
+
+async def aembed_documents(texts):
+    response = await async_client.embeddings.create(model="text-embedding-ada-002", input=texts)
+    return [item.embedding for item in response.data]
+
+async def run_blocking(fn, *args):
+    # Carry contextvars (the request's debug timings) into the pool thread, as submit_with_context does
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(retrieval_executor, contextvars.copy_context().run, fn, *args)
+
+async def alookup_cached_response(user_query):
+    # SQLite read (and hit-count update) on the pool, not the event loop
+    cached_response = await run_blocking(get_cached_response, user_query)
+    if cached_response:
+        return cached_response
+
+    try:
+        semantic_cache = await run_blocking(stores["semantic_cache"].get)
+        normalized_query = preprocess_query(user_query)
+        # Embed the raw query in the same request, since retrieval needs it on a miss
+        normalized_embedding, _ = await query_embedder.aembed_queries(
+            [normalized_query, user_query], aembed_documents
+        )
+    except Exception as e:
+        print(f"Warning: Semantic cache unavailable - {e}")
+        return None
+    cached_response, _ = await run_blocking(semantic_cache.lookup, normalized_embedding)
+    return cached_response
+
+async def amemoize(stage, make_coroutine, *inputs):
+    """Async StageCache.memoize; the SQLite cache is read and written on the retrieval pool."""
+    value = await run_blocking(stage_cache.get, stage, *inputs)
+    if value is None:
+        value = await make_coroutine()
+        await run_blocking(stage_cache.set, stage, value, *inputs)
+    return value
+
+async def aretrieve_all_sources(user_query, dropped=None):
+    """Async version of OC_app.retrieve_all_sources, with the same per-source deadlines."""
+    embedding_task = asyncio.ensure_future(query_embedder.aembed_queries([user_query], aembed_documents))
+
+    async def vector_search(name):
+        (embedding,) = await embedding_task
+        return await run_blocking(vector_searches(lambda: embedding)[name])
+
+    searches = {"whoosh": run_blocking(search_whoosh, user_query)}
+    for name in vector_searches(None):
+        searches[name] = vector_search(name)
+
+    async def with_deadline(name, search):
+        try:
+            with metrics.stage(f"retrieval_{name}"):
+                return await asyncio.wait_for(search, RETRIEVAL_TIMEOUTS[name])
+        except asyncio.TimeoutError:
+            metrics.inc("oc_retrieval_timeouts_total", source=name)
+            print(f"Warning: {name} retrieval missed its {RETRIEVAL_TIMEOUTS[name]}s deadline - dropping source")
+        except Exception as e:
+            print(f"Warning: {name} retrieval failed - {e}")
+        if dropped is not None:
+            dropped.append(name)
+        return []
+
+    results = await asyncio.gather(*(with_deadline(name, search) for name, search in searches.items()))
+    return split_unified_results(dict(zip(searches, results)))
+
+async def aretrieve_context(user_query):
+    """Async version of OC_app.retrieve_context."""
+    cached = await run_blocking(stage_cache.get, "retrieval", *context_cache_inputs(user_query))
+    if cached is not None:
+        return tuple(cached)
+    dropped = []
+    retrieved = await aretrieve_all_sources(user_query, dropped)
+    return await run_blocking(pack_retrieved_context, user_query, retrieved, dropped)
+
+async def areviewed_web_search_response(user_query):
+    web_response_raw = await amemoize(
+        "web_search", lambda: acomplete(web_search_request(user_query), "web_search"), user_query
+    )
+    return await amemoize(
+        "web_review", lambda: acomplete(review_request(web_response_raw), "web_review"), web_response_raw
+    )
+
+async def aanswer_query(user_query):
+    """Async version of OC_app.answer_query."""
+    rejected = await run_blocking(
+        out_of_scope_response, user_query, lambda: query_embedder.embed_query(user_query)
+    )
+    if rejected:
+        return rejected
+
+    # Speculative web branch, as in OC_app.run_query_pipeline
+    web_task = asyncio.ensure_future(areviewed_web_search_response(user_query))
+    try:
+        oc_links, combined_summary, structured_snippets = await aretrieve_context(user_query)
+
+        openai_response = await amemoize(
+            "rag", lambda: acomplete(rag_request(combined_summary, user_query), "rag"),
+            combined_summary, user_query
+        )
+        web_response_clean = await web_task
+    finally:
+        web_task.cancel() # no-op once finished; stops the web branch if RAG failed
+
+    if NO_CLEAR_ANSWER in openai_response.lower():
+        openai_response = web_response_clean
+        source_used = "web_search"
+    else:
+        rag_response = openai_response
+        openai_response = await amemoize(
+            "consolidation",
+            lambda: acomplete(consolidation_request(user_query, rag_response, web_response_clean), "consolidation"),
+            user_query, rag_response, web_response_clean
+        )
+        source_used = "rag + web_search"
+
+    structured_response = {
+        "answer": openai_response,
+        "links": oc_links,
+        "snippets": structured_snippets,
+        "source_used": source_used
+    }
+    await run_blocking(cache_query, user_query, structured_response)
+    return structured_response
+
+async def aanswer_with_single_flight(user_query):
+    """
+    Async version of OC_app.answer_with_single_flight: takes the cross-process flock
+    for this query, or reuses another process's answer. Waiting for another
+    process's lock sleeps on the event loop, so it never holds a retrieval pool
+    thread. Returns (response, coalesced).
+    """
+    async with single_flight.aflight(flight_key(user_query), lambda: run_blocking(lookup_cached_response, user_query)) as flight:
+        if flight.coalesced:
+            return flight.result["response"], True
+        # aanswer_query caches the answer, so other processes find it once the lock is released
+        return await aanswer_query(user_query), False
+
+def answer_task(user_query):
+    """Return (task, coalesced): the in-flight answer task for this query, started if there is none."""
+    key = flight_key(user_query)
+    task = in_flight.get(key)
+    if task is not None:
+        return task, True
+    task = asyncio.ensure_future(aanswer_with_single_flight(user_query))
+    in_flight[key] = task
+    task.add_done_callback(lambda _: in_flight.pop(key, None))
+    return task, False
+
+async def aanswer_with_coalescing(user_query):
+    """Returns (response, coalesced)."""
+    task, coalesced = answer_task(user_query)
+    # Shield so one client disconnecting does not cancel the answer for the others
+    structured_response, coalesced_across_processes = await asyncio.shield(task)
+    return structured_response, coalesced or coalesced_across_processes
+
+def log_background_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Warning: Background answer failed - {task.exception()}")
+
+async def aanswer_fast(user_query):
+    """Async version of OC_app.answer_fast."""
+    rejected = await run_blocking(
+        out_of_scope_response, user_query, lambda: query_embedder.embed_query(user_query)
+    )
+    if rejected:
+        return rejected
+
+    oc_links, combined_summary, structured_snippets = await aretrieve_context(user_query)
+    rag_response = await amemoize(
+        "rag", lambda: acomplete(rag_request(combined_summary, user_query), "rag"),
+        combined_summary, user_query
+    )
+    if NO_CLEAR_ANSWER in rag_response.lower():
+        metrics.inc("oc_fast_tier_total", result="fallback")
+        structured_response, _ = await aanswer_with_coalescing(user_query)
+        return structured_response
+
+    metrics.inc("oc_fast_tier_total", result="rag")
+    answer_task(user_query)[0].add_done_callback(log_background_failure)
+    return {
+        "answer": rag_response,
+        "links": oc_links,
+        "snippets": structured_snippets,
+        "source_used": "rag"
+    }
+
+
+@app.route('/query', methods=['POST'])
+async def query():
+    data = await request.get_json()
+    user_query = data.get('query', '').strip()
+    if not user_query:
+        metrics.inc("oc_requests_total", endpoint="query", outcome="invalid")
+        return jsonify({"error": "Query is required."}), 400
+    tier = data.get('tier', 'full')
+    if tier not in QUERY_TIERS:
+        metrics.inc("oc_requests_total", endpoint="query", outcome="invalid")
+        return jsonify({"error": f"tier must be one of {', '.join(QUERY_TIERS)}."}), 400
+
+    # Tasks created below copy this context, so their stages report into these timings
+    timings = RequestTimings() if request.headers.get(DEBUG_TIMING_HEADER) else None
+    current_timings.set(timings)
+    try:
+        with metrics.stage("request"):
+            cached_response = await alookup_cached_response(user_query)
+            if cached_response:
+                metrics.inc("oc_requests_total", endpoint="query", outcome="cached")
+                return jsonify(with_timings(cached_response["response"], timings, "cache"))
+
+            coalesced = False
+            if tier == "fast":
+                structured_response = await aanswer_fast(user_query)
+            else:
+                structured_response, coalesced = await aanswer_with_coalescing(user_query)
+    except Exception:
+        metrics.inc("oc_requests_total", endpoint="query", outcome="error")
+        raise
+
+    metrics.inc("oc_requests_total", endpoint="query", outcome="answered")
+    return jsonify(with_timings(structured_response, timings, "coalesced" if coalesced else "computed"))
+
+@app.route('/ready', methods=['GET'])
+async def ready():
+    """Readiness probe, as OC_app's /ready."""
+    is_ready, body = readiness()
+    return jsonify(body), 200 if is_ready else 503
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    """Prometheus text-format metrics for this worker process, as OC_app's /metrics."""
+    return Response(render_metrics(async_openai_calls), mimetype=METRICS_MIMETYPE)
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,30 @@
+import hashlib
+import math
+import re
+
+DIMENSIONS = 1536 # same as text-embedding-ada-002
+
+
+def hashing_embedding(text, dimensions=DIMENSIONS):
+    """
+    Deterministic stand-in for an embedding model: a signed, hashed bag of words,
+    L2-normalized. Texts that share words get similar vectors, which is enough to
+    exercise vector search and the semantic cache without calling OpenAI.
+    """
+    vector = [0.0] * dimensions
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.md5(word.encode()).digest()
+        index = int.from_bytes(digest[:4], "little") % dimensions
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class HashingEmbeddings:
+    """LangChain-compatible embeddings object backed by hashing_embedding()."""
+
+    def embed_documents(self, texts):
+        return [hashing_embedding(text) for text in texts]
+
+    def embed_query(self, text):
+        return hashing_embedding(text)
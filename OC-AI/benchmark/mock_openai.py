@@ -0,0 +1,161 @@
+"""
+Local stand-in for the OpenAI chat-completions and embeddings APIs.
+
+Responds like the real endpoints the app uses (including streamed completions)
+after a random delay drawn from a configurable log-normal distribution, so the
+service can be benchmarked offline and without cost. Point the app at it with
+OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+Usage:
+    python benchmark/mock_openai.py --port 8001 --chat-latency 1.5,0.4 --search-latency 4,0.5
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+
+import tiktoken
+
+from flask import Flask, Response, request, jsonify
+
+from hashing_embeddings import hashing_embedding
+
+app = Flask(__name__)
+
+# Filled in from the command line
+config = {
+    "chat_latency": (1.5, 0.4),
+    "search_latency": (4.0, 0.5),
+    "embedding_latency": (0.15, 0.3),
+    "token_latency": 0.01,
+    "no_answer_rate": 0.2,
+}
+encoding = tiktoken.get_encoding("cl100k_base")
+
+ANSWER = (
+    "As stated in Snippet 1, ocean warming and acidification are reshaping marine ecosystems. "
+    "According to research published by NOAA, coral reefs are especially exposed to rising "
+    "temperatures, and seagrass meadows store large amounts of carbon."
+)
+NO_ANSWER = "The snippets do not provide a clear answer to your question."
+
+
+def parse_latency(value):
+    median, sigma = (float(part) for part in value.split(","))
+    return median, sigma
+
+def sleep_for(latency):
+    median, sigma = latency
+    if median > 0:
+        time.sleep(random.lognormvariate(0, sigma) * median)
+
+def count_tokens(messages):
+    return sum(len(encoding.encode(message.get("content") or "")) for message in messages)
+
+def answer_for(body):
+    system_prompt = body["messages"][0].get("content", "")
+    if "context snippets" in system_prompt and random.random() < config["no_answer_rate"]:
+        return NO_ANSWER
+    return ANSWER
+
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    body = request.get_json()
+    is_search = "search" in body.get("model", "")
+    sleep_for(config["search_latency"] if is_search else config["chat_latency"])
+
+    answer = answer_for(body)
+    usage = {
+        "prompt_tokens": count_tokens(body["messages"]),
+        "completion_tokens": len(encoding.encode(answer)),
+    }
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    if not body.get("stream"):
+        return jsonify({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        })
+
+    def generate():
+        for word in answer.split(" "):
+            time.sleep(config["token_latency"])
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body["model"],
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        if body.get("stream_options", {}).get("include_usage"):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body["model"],
+                "choices": [],
+                "usage": usage
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(generate(), mimetype="text/event-stream")
+
+
+@app.route('/v1/embeddings', methods=['POST'])
+def embeddings():
+    body = request.get_json()
+    sleep_for(config["embedding_latency"])
+
+    inputs = body["input"]
+    if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+        inputs = [inputs]
+    # LangChain sends pre-tokenized input, so decode token ids back to text
+    texts = [encoding.decode(item) if isinstance(item, list) else item for item in inputs]
+
+    return jsonify({
+        "object": "list",
+        "model": body.get("model", "text-embedding-ada-002"),
+        "data": [
+            {"object": "embedding", "index": i, "embedding": hashing_embedding(text)}
+            for i, text in enumerate(texts)
+        ],
+        "usage": {"prompt_tokens": 0, "total_tokens": 0}
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local OpenAI stand-in for benchmarks.")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--chat-latency", default="1.5,0.4", help="median seconds,log-normal sigma")
+    parser.add_argument("--search-latency", default="4,0.5", help="median seconds,sigma for *-search-* models")
+    parser.add_argument("--embedding-latency", default="0.15,0.3", help="median seconds,sigma")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="seconds between streamed tokens")
+    parser.add_argument("--no-answer-rate", type=float, default=0.2,
+                        help="share of RAG completions that say the snippets have no clear answer")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config.update({
+        "chat_latency": parse_latency(args.chat_latency),
+        "search_latency": parse_latency(args.search_latency),
+        "embedding_latency": parse_latency(args.embedding_latency),
+        "token_latency": args.token_latency,
+        "no_answer_rate": args.no_answer_rate,
+    })
+    random.seed(args.seed)
+
+    app.run(host='127.0.0.1', port=args.port, threaded=True)
@@ -0,0 +1,301 @@
+"""
+Offline load test for the OC-AI service.
+
+Starts the OpenAI stand-in (mock_openai.py) and the real app pointed at it and at
+the fixtures from build_fixtures.py, waits for /ready, then replays a query corpus
+at a fixed concurrency and reports throughput, latency percentiles, cache-hit ratio
+and resident memory per worker. Use --url to benchmark an already running server
+instead (memory is then not reported).
+
+Usage:
+    python benchmark/build_fixtures.py
+    python benchmark/run_benchmark.py --requests 300 --concurrency 16 --workers 4
+    python benchmark/run_benchmark.py --server asgi --chat-latency 0.5,0.3
+    python benchmark/run_benchmark.py --check-fast-tier --no-answer-rate 0
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCHMARK_DIR)
+DEBUG_TIMING_HEADER = "X-OC-Debug-Timing"
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def http_json(url, payload=None, headers=None, timeout=300):
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json", **(headers or {})})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return response.status, json.loads(response.read())
+
+def wait_until_ready(base_url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            status, _ = http_json(f"{base_url}/ready", timeout=5)
+            if status == 200:
+                return
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"{base_url} did not become ready within {timeout}s")
+
+def wait_for_port(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=2)
+            return
+        except urllib.error.HTTPError:
+            return # the server answered, just not with 2xx
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise TimeoutError(f"{url} did not start within {timeout}s")
+
+def load_queries(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+# --- Memory per worker (Linux /proc) ---
+
+def child_pids(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+class MemorySampler(threading.Thread):
+    """Samples the resident memory of the server's worker processes until stopped."""
+
+    def __init__(self, server_pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.server_pid = server_pid
+        self.interval = interval
+        self.peak = {}
+        self.last = {}
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        # gunicorn and hypercorn fork workers from a master; a bare server is its own worker
+        pids = child_pids(self.server_pid) or [self.server_pid]
+        for pid in pids:
+            rss = rss_mb(pid)
+            if rss is not None:
+                self.last[pid] = rss
+                self.peak[pid] = max(rss, self.peak.get(pid, 0))
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.sample()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.sample()
+
+
+# --- Processes under test ---
+
+def start_mock_openai(args):
+    command = [
+        sys.executable, os.path.join(BENCHMARK_DIR, "mock_openai.py"),
+        "--port", str(args.mock_port),
+        "--chat-latency", args.chat_latency,
+        "--search-latency", args.search_latency,
+        "--embedding-latency", args.embedding_latency,
+        "--no-answer-rate", str(args.no_answer_rate),
+        "--seed", str(args.seed),
+    ]
+    process = subprocess.Popen(command, cwd=BENCHMARK_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(f"http://127.0.0.1:{args.mock_port}/")
+    return process
+
+def start_app(args, state_dir):
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+        "OC_DATA_DIR": os.path.abspath(args.fixtures),
+        "WHOOSH_INDEX_DIR": os.path.join(os.path.abspath(args.fixtures), "index"),
+        # Fresh caches for every run, so runs are comparable
+        "CACHE_FILE": os.path.join(state_dir, "query_cache.sqlite3"),
+        "EMBEDDING_CACHE_FILE": os.path.join(state_dir, "query_embeddings.pkl"),
+        "SEMANTIC_CACHE_DIR": os.path.join(state_dir, "semantic_cache_db"),
+        "SINGLE_FLIGHT_LOCK_DIR": os.path.join(state_dir, "locks"),
+    })
+    bind = f"127.0.0.1:{args.port}"
+    if args.server == "asgi":
+        command = ["hypercorn", "OC_asgi:app", "--bind", bind, "--workers", str(args.workers)]
+    else:
+        command = ["gunicorn", "OC_app:app", "--bind", bind, "--workers", str(args.workers),
+                   "--threads", str(args.threads), "--timeout", "300"]
+    log = open(os.path.join(state_dir, "server.log"), "w")
+    return subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+# --- Load generation ---
+
+def run_load(base_url, queries, total_requests, concurrency, seed):
+    rng = random.Random(seed)
+    # Sampling with replacement makes repeats (and so cache hits) part of the workload
+    workload = [rng.choice(queries) for _ in range(total_requests)]
+    results = []
+    results_lock = threading.Lock()
+
+    def send(query):
+        start = time.perf_counter()
+        try:
+            _, body = http_json(f"{base_url}/query", {"query": query}, headers={DEBUG_TIMING_HEADER: "1"})
+            ok = True
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            body, ok = {}, False
+        elapsed = time.perf_counter() - start
+        with results_lock:
+            results.append({
+                "latency": elapsed,
+                "ok": ok,
+                # "cache", "coalesced" (shared an identical in-flight query's answer) or "computed"
+                "served": body.get("served") if ok else None,
+            })
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, workload))
+    return results, time.perf_counter() - started
+
+def check_fast_tier(base_url, query, timeout):
+    """
+    Send one fast-tier request and check that the full answer it queues in the
+    background reaches the answer cache. Polls with the fast tier too, so the
+    check never computes the full answer in the foreground itself.
+    """
+    _, body = http_json(f"{base_url}/query", {"query": query, "tier": "fast"}, headers={DEBUG_TIMING_HEADER: "1"})
+    if body.get("source_used") != "rag":
+        print(f"Fast tier: fell back to the full pipeline ({body.get('source_used')}); nothing to check")
+        return True
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(1)
+        _, body = http_json(f"{base_url}/query", {"query": query, "tier": "fast"}, headers={DEBUG_TIMING_HEADER: "1"})
+        if body.get("served") == "cache":
+            print(f"Fast tier: full answer cached ({body.get('source_used')})")
+            return body.get("source_used") != "rag"
+    print(f"Fast tier: full answer not cached within {timeout:.0f}s")
+    return False
+
+def report(results, wall_time, sampler):
+    latencies = [r["latency"] for r in results if r["ok"]]
+    succeeded = len(latencies)
+    cached = sum(r["served"] == "cache" for r in results)
+    coalesced = sum(r["served"] == "coalesced" for r in results)
+
+    print(f"Requests:      {len(results)} ({len(results) - succeeded} failed)")
+    print(f"Wall time:     {wall_time:.2f}s")
+    print(f"Throughput:    {succeeded / wall_time:.2f} req/s")
+    if latencies:
+        print(f"Latency mean:  {statistics.mean(latencies):.3f}s")
+        for pct in (50, 95, 99):
+            print(f"Latency p{pct}:   {percentile(latencies, pct):.3f}s")
+    if succeeded:
+        print(f"Cache hits:    {cached}/{succeeded} ({cached / succeeded:.1%})")
+        print(f"Coalesced:     {coalesced}/{succeeded} ({coalesced / succeeded:.1%})")
+    if sampler is not None:
+        for pid in sorted(sampler.peak):
+            print(f"Worker {pid}:  peak RSS {sampler.peak[pid]:.0f} MB, final RSS {sampler.last[pid]:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the OC-AI service.")
+    parser.add_argument("--queries", default=os.path.join(BENCHMARK_DIR, "queries.txt"))
+    parser.add_argument("--fixtures", default=os.path.join(BENCHMARK_DIR, "fixtures"))
+    parser.add_argument("--requests", type=int, default=200, help="Total requests to send")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="Benchmark an already running server instead of starting one")
+    parser.add_argument("--server", choices=["wsgi", "asgi"], default="wsgi",
+                        help="gunicorn + OC_app, or hypercorn + OC_asgi")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--mock-port", type=int, default=8001)
+    parser.add_argument("--chat-latency", default="1.5,0.4", help="median seconds,log-normal sigma")
+    parser.add_argument("--search-latency", default="4,0.5", help="median seconds,sigma for the web-search model")
+    parser.add_argument("--embedding-latency", default="0.15,0.3", help="median seconds,sigma")
+    parser.add_argument("--no-answer-rate", type=float, default=0.2)
+    parser.add_argument("--ready-timeout", type=float, default=300)
+    parser.add_argument("--check-fast-tier", action="store_true",
+                        help="Instead of the load test, check that a fast-tier answer is completed and cached")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    processes = []
+    sampler = None
+    state_dir = tempfile.mkdtemp(prefix="oc_benchmark_")
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            if not os.path.isdir(args.fixtures):
+                sys.exit(f"No fixtures at {args.fixtures}; run benchmark/build_fixtures.py first")
+            processes.append(start_mock_openai(args))
+            server = start_app(args, state_dir)
+            processes.append(server)
+            base_url = f"http://127.0.0.1:{args.port}"
+            wait_until_ready(base_url, args.ready_timeout)
+            sampler = MemorySampler(server.pid)
+            sampler.start()
+
+        if args.check_fast_tier:
+            if not check_fast_tier(base_url, queries[0], args.ready_timeout):
+                sys.exit(1)
+            return
+
+        results, wall_time = run_load(base_url, queries, args.requests, args.concurrency, args.seed)
+        if sampler is not None:
+            sampler.stop()
+        report(results, wall_time, sampler)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class SQLiteCache:
+    """
+    Persistent key/value cache backed by SQLite in WAL mode.
+
+    Every `set` writes a single row, so the cost of caching an answer does not grow
+    with the size of the cache, and several gunicorn workers can read and write the
+    same file at once. Values are stored as JSON. Entries can carry a TTL in seconds
+    (None = never expires). When the table grows past `max_entries`, the least
+    recently used rows are evicted.
+    """
+
+    def __init__(self, path, max_entries=50000, evict_every=100, timeout=5.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.timeout = timeout
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        conn.commit()
+
+    def _conn(self):
+        # sqlite3 connections must not be shared between threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired."""
+        value, status = self.lookup(key)
+        return value if status == "hit" else None
+
+    def lookup(self, key):
+        """
+        Return (value, status) where status is "hit", "miss" or "expired". For an
+        expired entry the stale value is returned (and the row deleted), so callers
+        can report what expired.
+        """
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None, "miss"
+        value, expires_at = row
+        if expires_at is not None and expires_at <= now:
+            self.delete(key)
+            return json.loads(value), "expired"
+        try:
+            conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+        except sqlite3.OperationalError:
+            # Another process holds the write lock; recency is best-effort
+            conn.rollback()
+        return json.loads(value), "hit"
+
+    def set(self, key, value, ttl=None):
+        conn = self._conn()
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        conn.execute(
+            """
+            INSERT INTO cache (key, value, created_at, expires_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                value = excluded.value,
+                created_at = excluded.created_at,
+                expires_at = excluded.expires_at,
+                accessed_at = excluded.accessed_at
+            """,
+            (key, json.dumps(value), now, expires_at, now)
+        )
+        conn.commit()
+
+        with self._writes_lock:
+            self._writes += 1
+            due = self._writes % self.evict_every == 0
+        if due:
+            self.evict()
+
+    def delete(self, key):
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        conn.commit()
+
+    def evict(self):
+        """Drop expired rows, then the least recently used rows above max_entries."""
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        (count,) = conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                (overflow,)
+            )
+        conn.commit()
+
+    def __len__(self):
+        (count,) = self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()
+        return count
@@ -0,0 +1,92 @@
+import hashlib
+import re
+
+import tiktoken
+
+
+def get_encoding(model="gpt-4o"):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def content_key(text):
+    """
+    Source-independent candidate id: a hash of the lowercased words, so the same
+    passage gets the same id whichever source or corpus returned it.
+    """
+    return hashlib.md5(" ".join(re.findall(r"\w+", text.lower())).encode()).hexdigest()
+
+
+def reciprocal_rank_fusion(ranked_lists, k=60):
+    """
+    Fuse several ranked lists of candidates with reciprocal rank fusion
+    (score = sum of 1 / (k + rank) over the lists a candidate appears in).
+    Candidates are compared by their "id", which must be the same across lists
+    for the same document (see content_key) for the fusion to reward agreement.
+    Returns candidates best first.
+    """
+    scores = {}
+    candidates = {}
+    for ranked in ranked_lists:
+        for rank, candidate in enumerate(ranked, 1):
+            scores[candidate["id"]] = scores.get(candidate["id"], 0.0) + 1.0 / (k + rank)
+            candidates.setdefault(candidate["id"], candidate)
+    order = sorted(scores, key=lambda candidate_id: scores[candidate_id], reverse=True)
+    return [candidates[candidate_id] for candidate_id in order]
+
+
+def shingles(text, size=5):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def remove_near_duplicates(candidates, threshold=0.8):
+    """Drop candidates whose word 5-gram Jaccard similarity to a better-ranked one is >= threshold."""
+    kept = []
+    kept_shingles = []
+    for candidate in candidates:
+        candidate_shingles = shingles(candidate["text"])
+        if any(
+            len(candidate_shingles & other) / len(candidate_shingles | other) >= threshold
+            for other in kept_shingles
+        ):
+            continue
+        kept.append(candidate)
+        kept_shingles.append(candidate_shingles)
+    return kept
+
+
+def truncate_to_tokens(text, max_tokens, encoding):
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    truncated = encoding.decode(tokens[:max_tokens])
+    last_period = truncated.rfind(". ")
+    if last_period != -1:
+        truncated = truncated[:last_period + 1]
+    return truncated + "..."
+
+
+def pack_snippets(candidates, token_budget, snippet_max_tokens, encoding):
+    """
+    Format candidates (best first) as numbered snippet lines until `token_budget`
+    tokens are used. Each snippet is cut to at most `snippet_max_tokens` tokens.
+    Returns (packed candidates, lines, tokens used).
+    """
+    packed = []
+    lines = []
+    used = 0
+    for candidate in candidates:
+        text = truncate_to_tokens(candidate["text"], snippet_max_tokens, encoding)
+        line = f"- Snippet {len(packed) + 1} ({candidate['label']}): {text}\n"
+        line_tokens = len(encoding.encode(line))
+        if used + line_tokens > token_budget:
+            continue # a shorter, lower-ranked snippet may still fit
+        packed.append(candidate)
+        lines.append(line)
+        used += line_tokens
+    return packed, lines, used
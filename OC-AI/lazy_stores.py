@@ -0,0 +1,92 @@
+import threading
+import time
+
+
+class LazyStore:
+    """
+    A resource (vector store, index, cache) that is loaded on first use or in the
+    background, instead of at import time.
+
+    Load state and timing are recorded for the /ready endpoint. A failed load is
+    retried on the next get(), or by retry_in_background() (called from the
+    readiness probe), so a store that appears later (e.g. a volume that mounts
+    after startup) is picked up without a restart, even on a replica that gets no
+    traffic until it is ready.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.state = "pending"
+        self.load_seconds = None
+        self.error = None
+        self.failed_at = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.state == "ready":
+            return self._value
+        with self._lock:
+            if self.state != "ready":
+                self._load()
+        if self.state != "ready":
+            raise RuntimeError(f"{self.name} is unavailable: {self.error}")
+        return self._value
+
+    def _load(self):
+        self.state = "loading"
+        start = time.monotonic()
+        try:
+            self._value = self.loader()
+            self.state = "ready"
+            self.error = None
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            self.failed_at = time.monotonic()
+            print(f"Warning: Failed to load {self.name} - {e}")
+        finally:
+            self.load_seconds = round(time.monotonic() - start, 3)
+
+    def retry_in_background(self, min_interval):
+        """Start a reload on a daemon thread if the last load failed at least `min_interval` seconds ago."""
+        if self.state != "failed" or time.monotonic() - self.failed_at < min_interval:
+            return
+        # Only one retry at a time; get() itself holds the lock while loading
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self.state != "failed":
+                return
+            self.state = "pending"
+        finally:
+            self._lock.release()
+        threading.Thread(target=_load_quietly, args=(self,), name=f"reload-{self.name}", daemon=True).start()
+
+    def status(self):
+        return {"state": self.state, "load_seconds": self.load_seconds, "error": self.error}
+
+
+def _load_quietly(store):
+    try:
+        store.get()
+    except RuntimeError:
+        pass # already recorded on the store
+
+def load_in_background(stores, on_done=None):
+    """Load every store on its own daemon thread; call on_done() once all have finished."""
+    threads = [
+        threading.Thread(target=_load_quietly, args=(store,), name=f"load-{store.name}", daemon=True)
+        for store in stores
+    ]
+    for thread in threads:
+        thread.start()
+
+    def wait_for_all():
+        for thread in threads:
+            thread.join()
+        if on_done is not None:
+            on_done()
+
+    threading.Thread(target=wait_for_all, name="load-stores", daemon=True).start()
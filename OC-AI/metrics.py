@@ -0,0 +1,141 @@
+import contextvars
+import threading
+import time
+
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+# Per-request timing breakdown, set by the request handler when debug timings are asked for
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+
+def escape_label_value(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RequestTimings:
+    """Accumulates seconds per stage for one request. Stages may report from worker threads."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage_name, seconds):
+        with self._lock:
+            self._stages[stage_name] = self._stages.get(stage_name, 0.0) + seconds
+
+    def as_dict(self):
+        with self._lock:
+            timings = {name: round(seconds, 4) for name, seconds in self._stages.items()}
+        timings["total"] = round(time.perf_counter() - self.started, 4)
+        return timings
+
+
+class Metrics:
+    """
+    Minimal in-process metrics registry (counters, gauges and histograms) rendered in
+    the Prometheus text exposition format. Metrics are per worker process.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._types = {}
+        self._help = {}
+        self._values = {} # (name, labels) -> float, or [bucket counts, sum, count] for histograms
+
+    def describe(self, name, metric_type, help_text):
+        self._types[name] = metric_type
+        self._help[name] = help_text
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = (name, self._labels(labels))
+        with self._lock:
+            self._types.setdefault(name, "counter")
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._types.setdefault(name, "gauge")
+            self._values[(name, self._labels(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, self._labels(labels))
+        with self._lock:
+            self._types.setdefault(name, "histogram")
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{escape_label_value(value)}"' for key, value in pairs) + "}"
+
+    def render(self):
+        with self._lock:
+            values = {key: (list(value[0]), value[1], value[2]) if isinstance(value, list) else value
+                      for key, value in self._values.items()}
+            types = dict(self._types)
+
+        lines = []
+        for name in sorted(types):
+            series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+            if not series:
+                continue
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {types[name]}")
+            for labels, value in series:
+                if types[name] == "histogram":
+                    counts, total, count = value
+                    for bound, bucket_count in zip(self.buckets, counts):
+                        lines.append(f"{name}_bucket{self._format_labels(labels, [('le', str(bound))])} {bucket_count}")
+                    lines.append(f"{name}_bucket{self._format_labels(labels, [('le', '+Inf')])} {count}")
+                    lines.append(f"{name}_sum{self._format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+                else:
+                    lines.append(f"{name}{self._format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    @contextmanager
+    def stage(self, stage_name):
+        """Time a pipeline stage: latency histogram, error counter and per-request breakdown."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc("oc_stage_errors_total", stage=stage_name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("oc_stage_duration_seconds", elapsed, stage=stage_name)
+            timings = current_timings.get()
+            if timings is not None:
+                timings.add(stage_name, elapsed)
+
+    def timed(self, stage_name, fn):
+        """Wrap a zero-argument function so each call is timed as `stage_name`."""
+        def wrapper():
+            with self.stage(stage_name):
+                return fn()
+        return wrapper
+
+
+def submit_with_context(executor, fn, *args):
+    """executor.submit() that carries contextvars (e.g. the request's timings) into the worker thread."""
+    context = contextvars.copy_context()
+    return executor.submit(context.run, fn, *args)
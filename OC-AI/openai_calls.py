@@ -0,0 +1,374 @@
+import asyncio
+import random
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import openai
+
+# Errors worth another attempt. Rate limits and timeouts also mean the API is
+# overloaded, so they shrink the concurrency limit.
+OVERLOAD_ERRORS = (openai.RateLimitError, openai.APITimeoutError)
+RETRYABLE_ERRORS = OVERLOAD_ERRORS + (openai.APIConnectionError, openai.InternalServerError)
+
+
+class CallDeadlineExceeded(TimeoutError):
+    """An OpenAI call (including retries and waiting for a concurrency slot) ran past its deadline."""
+
+
+def classify_error(error):
+    if isinstance(error, OVERLOAD_ERRORS):
+        return "overload"
+    if isinstance(error, RETRYABLE_ERRORS):
+        return "retryable"
+    return "error"
+
+def retry_after(error):
+    """Seconds the API asked us to wait (Retry-After header), or None."""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class AIMDLimiter:
+    """
+    Adaptive cap on concurrent OpenAI requests in this process.
+
+    The limit grows by about one slot per `limit` successful calls (additive increase)
+    and is multiplied by `backoff` when a call is rate limited or times out
+    (multiplicative decrease, at most once per `cooldown` seconds so one burst of
+    failures counts once). Callers wait for a free slot, which applies backpressure
+    before the API starts returning 429s.
+    """
+
+    def __init__(self, initial=32, min_limit=4, max_limit=256, backoff=0.5, cooldown=1.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def _has_slot(self):
+        return self.in_flight < int(self.limit)
+
+    def _finish(self, outcome):
+        self.in_flight -= 1
+        if outcome == "ok":
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        elif outcome == "overload":
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+
+    def acquire(self, timeout):
+        """Take a slot, waiting up to `timeout` seconds. Returns False if none freed up."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._has_slot():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def try_acquire(self):
+        with self._cond:
+            if not self._has_slot():
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, outcome):
+        """Give the slot back. `outcome` is "ok", "overload", "retryable" or "error"."""
+        with self._cond:
+            self._finish(outcome)
+            self._cond.notify_all()
+
+    def stats(self):
+        return {"limit": int(self.limit), "in_flight": self.in_flight}
+
+
+class AsyncAIMDLimiter(AIMDLimiter):
+    """AIMDLimiter for coroutines on one event loop."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._async_cond = None
+
+    def _condition(self):
+        # Created on first use so it binds to the running loop
+        if self._async_cond is None:
+            self._async_cond = asyncio.Condition()
+        return self._async_cond
+
+    async def acquire(self, timeout):
+        cond = self._condition()
+        async with cond:
+            try:
+                await asyncio.wait_for(cond.wait_for(self._has_slot), max(timeout, 0.001))
+            except asyncio.TimeoutError:
+                return False
+            self.in_flight += 1
+            return True
+
+    def try_acquire(self):
+        # No await between the check and the increment, so this is atomic on the loop
+        if not self._has_slot():
+            return False
+        self.in_flight += 1
+        return True
+
+    async def release(self, outcome):
+        cond = self._condition()
+        async with cond:
+            self._finish(outcome)
+            cond.notify_all()
+
+
+class LatencyWindow:
+    """Recent successful call latencies per call name, for picking hedge delays."""
+
+    def __init__(self, size=200):
+        self.size = size
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.size)).append(seconds)
+
+    def percentile(self, name, pct, min_samples):
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+class _CallManagerBase:
+    """
+    Shared policy for CallManager and AsyncCallManager.
+
+    `policies` maps a call name to overrides of `deadline` (seconds for the whole
+    call, retries included), `retries` and `hedge` (whether a duplicate request may
+    be sent when the first is slower than the `hedge_percentile` of recent calls).
+    """
+
+    def __init__(self, limiter, metrics=None, policies=None, deadline=60.0, retries=2, hedge=False,
+                 backoff_base=0.5, backoff_max=8.0, hedge_percentile=95, hedge_min_samples=20):
+        self.limiter = limiter
+        self.metrics = metrics
+        self.policies = policies or {}
+        self.defaults = {"deadline": deadline, "retries": retries, "hedge": hedge}
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = LatencyWindow()
+
+    def policy(self, name):
+        return {**self.defaults, **self.policies.get(name, {})}
+
+    def _inc(self, metric, **labels):
+        if self.metrics is not None:
+            self.metrics.inc(metric, **labels)
+
+    def _hedge_delay(self, name, hedge):
+        if not hedge or not self.hedge_percentile:
+            return None
+        return self.latencies.percentile(name, self.hedge_percentile, self.hedge_min_samples)
+
+    def _backoff(self, attempt, error):
+        # Full jitter, but never sooner than the API asked for
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return max(delay, retry_after(error) or 0)
+
+    def _retry_delay(self, name, policy, attempt, error, deadline):
+        """Seconds to wait before retrying after `error`, or None if it should be raised."""
+        if classify_error(error) == "error" or attempt >= policy["retries"]:
+            return None
+        delay = self._backoff(attempt, error)
+        if time.monotonic() + delay >= deadline:
+            return None
+        self._inc("oc_openai_retries_total", call=name)
+        return delay
+
+    def _deadline_exceeded(self, name, error=None):
+        self._inc("oc_openai_deadline_exceeded_total", call=name)
+        return CallDeadlineExceeded(f"OpenAI {name} call ran past its deadline" + (f": {error}" if error else ""))
+
+    def _record_attempt(self, name, role, outcome, started):
+        self._inc("oc_openai_attempts_total", call=name, role=role, outcome=outcome)
+        if outcome == "ok":
+            self.latencies.add(name, time.monotonic() - started)
+
+    def stats(self):
+        return self.limiter.stats()
+
+
+class CallManager(_CallManagerBase):
+    """
+    Runs OpenAI requests with a per-call deadline, jittered retries on retryable
+    errors, optional hedging and an adaptive concurrency limit (AIMDLimiter).
+    """
+
+    def __init__(self, limiter, hedge_workers=None, **kwargs):
+        super().__init__(limiter, **kwargs)
+        # Hedged calls run both requests on this pool, so size it for a full limiter plus hedges
+        self._executor = ThreadPoolExecutor(
+            max_workers=hedge_workers or 2 * limiter.max_limit, thread_name_prefix="openai-hedge"
+        )
+
+    def call(self, name, request, hedge=None):
+        """
+        Return request(timeout), where `request` makes one API request and `timeout` is
+        the time left before the call's deadline. `hedge` overrides the call's policy.
+        """
+        policy = self.policy(name)
+        hedge = policy["hedge"] if hedge is None else hedge
+        deadline = time.monotonic() + policy["deadline"]
+        attempt = 0
+        while True:
+            try:
+                return self._attempt(name, request, deadline, hedge)
+            except CallDeadlineExceeded:
+                raise
+            except Exception as e:
+                if time.monotonic() >= deadline:
+                    raise self._deadline_exceeded(name, e) from e
+                delay = self._retry_delay(name, policy, attempt, e, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def _attempt(self, name, request, deadline, hedge):
+        hedge_delay = self._hedge_delay(name, hedge)
+        if hedge_delay is None:
+            return self._run_one(name, request, deadline, "primary")
+
+        primary = self._executor.submit(self._run_one, name, request, deadline, "primary")
+        done, _ = wait([primary], timeout=min(hedge_delay, max(deadline - time.monotonic(), 0)))
+        # Only hedge with spare capacity, so hedges never add to an overload
+        if done or not self.limiter.try_acquire():
+            return primary.result()
+
+        self._inc("oc_openai_hedges_total", call=name)
+        pending = {primary, self._executor.submit(self._run_one, name, request, deadline, "hedge", True)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The slower request cannot be cancelled mid-flight; its result is dropped
+                    self._inc("oc_openai_hedge_wins_total", call=name, winner="primary" if future is primary else "hedge")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _run_one(self, name, request, deadline, role, acquired=False):
+        if not acquired:
+            waited = time.monotonic()
+            if not self.limiter.acquire(deadline - waited):
+                self._inc("oc_openai_limiter_rejections_total", call=name)
+                raise self._deadline_exceeded(name, "no free concurrency slot")
+            if self.metrics is not None:
+                self.metrics.observe("oc_openai_limiter_wait_seconds", time.monotonic() - waited, call=name)
+
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            response = request(max(deadline - started, 0.001))
+            outcome = "ok"
+            return response
+        except Exception as e:
+            outcome = classify_error(e)
+            raise
+        finally:
+            self.limiter.release(outcome)
+            self._record_attempt(name, role, outcome, started)
+
+
+class AsyncCallManager(_CallManagerBase):
+    """CallManager for coroutines: the losing request of a hedge is cancelled."""
+
+    async def call(self, name, request, hedge=None):
+        """Return await request(timeout); see CallManager.call."""
+        policy = self.policy(name)
+        hedge = policy["hedge"] if hedge is None else hedge
+        deadline = time.monotonic() + policy["deadline"]
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt(name, request, deadline, hedge)
+            except CallDeadlineExceeded:
+                raise
+            except Exception as e:
+                if time.monotonic() >= deadline:
+                    raise self._deadline_exceeded(name, e) from e
+                delay = self._retry_delay(name, policy, attempt, e, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _attempt(self, name, request, deadline, hedge):
+        hedge_delay = self._hedge_delay(name, hedge)
+        if hedge_delay is None:
+            return await self._run_one(name, request, deadline, "primary")
+
+        primary = asyncio.ensure_future(self._run_one(name, request, deadline, "primary"))
+        done, _ = await asyncio.wait({primary}, timeout=min(hedge_delay, max(deadline - time.monotonic(), 0)))
+        if done or not self.limiter.try_acquire():
+            return await primary
+
+        self._inc("oc_openai_hedges_total", call=name)
+        hedge_task = asyncio.ensure_future(self._run_one(name, request, deadline, "hedge", True))
+        pending = {primary, hedge_task}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._inc("oc_openai_hedge_wins_total", call=name, winner="primary" if task is primary else "hedge")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _run_one(self, name, request, deadline, role, acquired=False):
+        if not acquired:
+            waited = time.monotonic()
+            if not await self.limiter.acquire(deadline - waited):
+                self._inc("oc_openai_limiter_rejections_total", call=name)
+                raise self._deadline_exceeded(name, "no free concurrency slot")
+            if self.metrics is not None:
+                self.metrics.observe("oc_openai_limiter_wait_seconds", time.monotonic() - waited, call=name)
+
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            response = await request(max(deadline - started, 0.001))
+            outcome = "ok"
+            return response
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = classify_error(e)
+            raise
+        finally:
+            await self.limiter.release(outcome)
+            self._record_attempt(name, role, outcome, started)
@@ -0,0 +1,137 @@
+import atexit
+import hashlib
+import os
+import pickle
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class QueryEmbeddingCache:
+    """
+    Embeds each query once and remembers the vector.
+
+    Wraps a LangChain embeddings object (e.g. OpenAIEmbeddings) with a bounded,
+    thread-safe LRU keyed on the query text. The LRU is persisted to `cache_file`
+    every `save_every` new entries and at interpreter exit, so repeated and
+    warm-up queries skip the embedding API across restarts.
+    """
+
+    def __init__(self, embeddings, cache_file, max_entries=5000, save_every=50):
+        self.embeddings = embeddings
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.save_every = save_every
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._unsaved = 0
+        self._load()
+        atexit.register(self.save)
+
+    @staticmethod
+    def _key(text):
+        return hashlib.md5(text.strip().encode()).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "rb") as f:
+                self._entries = pickle.load(f)
+        except Exception as e:
+            print(f"Warning: Failed to read embedding cache - {e}")
+            self._entries = OrderedDict()
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def save(self):
+        with self._lock:
+            if not self._unsaved:
+                return
+            snapshot = OrderedDict(self._entries)
+            self._unsaved = 0
+        # Write to a temp file and rename so a crash never leaves a truncated cache
+        tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, "wb") as f:
+                pickle.dump(snapshot, f)
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            print(f"Warning: Failed to write embedding cache - {e}")
+
+    def _get(self, key):
+        vector = self._entries.get(key)
+        if vector is not None:
+            self._entries.move_to_end(key)
+        return vector
+
+    def _put(self, key, vector):
+        self._entries[key] = np.asarray(vector, dtype=np.float32)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._unsaved += 1
+        return self._unsaved >= self.save_every
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+    def _split(self, texts):
+        """Return (keys, cached vectors by key, uncached text by key)."""
+        keys = [self._key(text) for text in texts]
+        vectors = {}
+        with self._lock:
+            for key in keys:
+                vector = self._get(key)
+                if vector is not None:
+                    vectors[key] = vector
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text.strip()
+        return keys, vectors, missing
+
+    def _merge(self, keys, vectors, missing, new_vectors):
+        should_save = False
+        with self._lock:
+            for key, vector in zip(missing, new_vectors):
+                vectors[key] = np.asarray(vector, dtype=np.float32)
+                should_save = self._put(key, vectors[key]) or should_save
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+
+        if should_save:
+            self.save()
+        return [vectors[key].tolist() for key in keys]
+
+    def embed_queries(self, texts):
+        """
+        Embed a list of queries, sending only the uncached ones to the API in a
+        single batched request. Returns plain float lists in input order.
+        """
+        keys, vectors, missing = self._split(texts)
+        new_vectors = self.embeddings.embed_documents(list(missing.values())) if missing else []
+        return self._merge(keys, vectors, missing, new_vectors)
+
+    async def aembed_queries(self, texts, embed_documents):
+        """
+        Async variant of embed_queries. `embed_documents` is a coroutine function
+        taking a list of texts and returning their vectors.
+        """
+        keys, vectors, missing = self._split(texts)
+        new_vectors = await embed_documents(list(missing.values())) if missing else []
+        return self._merge(keys, vectors, missing, new_vectors)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
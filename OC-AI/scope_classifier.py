@@ -0,0 +1,138 @@
+"""
+Local scope filter: decides from the query embedding alone whether a question is
+about marine science, so off-topic questions can be rejected before any retrieval
+or chat completion.
+
+Each corpus is summarised by a few centroids (spherical k-means over its stored
+chunk embeddings). A query is in scope when its cosine similarity to the closest
+centroid reaches the threshold. Building the centroids copies the stored
+embeddings, so it makes no embedding API calls.
+
+Usage:
+    python scope_classifier.py --out ./data/scope_centroids.npz --clusters 8
+    python scope_classifier.py --out ./data/scope_centroids.npz --calibrate questions.txt
+"""
+import argparse
+import os
+import threading
+
+import numpy as np
+
+from unified_index import CORPUS_DIRS
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class ScopeClassifier:
+    """
+    Nearest-centroid scope check. `centroids` is an (n, d) array of unit vectors and
+    `labels` names the corpus of each row.
+    """
+
+    def __init__(self, centroids, labels, threshold=0.75):
+        self.centroids = normalize(centroids)
+        self.labels = list(labels)
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._stats = {"in_scope": 0, "out_of_scope": 0}
+
+    @classmethod
+    def load(cls, path, threshold=0.75):
+        data = np.load(path)
+        return cls(data["centroids"], [str(label) for label in data["labels"]], threshold)
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, labels=np.array(self.labels))
+
+    def score(self, query_embedding):
+        """Return (similarity, corpus) of the centroid closest to the query."""
+        similarities = self.centroids @ normalize(query_embedding)
+        best = int(np.argmax(similarities))
+        return float(similarities[best]), self.labels[best]
+
+    def classify(self, query_embedding):
+        """Return (in_scope, similarity, corpus)."""
+        similarity, corpus = self.score(query_embedding)
+        in_scope = similarity >= self.threshold
+        with self._lock:
+            self._stats["in_scope" if in_scope else "out_of_scope"] += 1
+        return in_scope, similarity, corpus
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "threshold": self.threshold, "centroids": len(self.labels)}
+
+
+def spherical_kmeans(vectors, clusters, iterations=20, seed=0):
+    """Unit-norm centroids of `vectors` (already normalized), clustered by cosine similarity."""
+    clusters = min(clusters, len(vectors))
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for i in range(clusters):
+            members = vectors[assignment == i]
+            if len(members):
+                centroids[i] = members.sum(axis=0)
+        centroids = normalize(centroids)
+    return centroids
+
+def stored_embeddings(persist_directory, batch_size=2000):
+    from langchain.vectorstores import Chroma
+
+    if not os.path.isdir(persist_directory):
+        raise FileNotFoundError(f"No Chroma store at {persist_directory}")
+    store = Chroma(persist_directory=persist_directory)
+    batches = []
+    offset = 0
+    while True:
+        batch = store._collection.get(include=["embeddings"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        batches.append(normalize(batch["embeddings"]))
+        offset += len(batch["ids"])
+    return np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+
+def build_scope_classifier(corpus_dirs=CORPUS_DIRS, clusters=8, threshold=0.75):
+    centroids, labels = [], []
+    for corpus, persist_directory in corpus_dirs.items():
+        vectors = stored_embeddings(persist_directory)
+        if not len(vectors):
+            print(f"Skipping {corpus}: no embeddings in {persist_directory}")
+            continue
+        corpus_centroids = spherical_kmeans(vectors, clusters)
+        centroids.append(corpus_centroids)
+        labels.extend([corpus] * len(corpus_centroids))
+        print(f"{corpus}: {len(vectors)} chunks -> {len(corpus_centroids)} centroids")
+    return ScopeClassifier(np.concatenate(centroids), labels, threshold)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the scope filter centroids from the corpus stores.")
+    parser.add_argument("--out", default="./data/scope_centroids.npz", help="Output centroid file")
+    parser.add_argument("--clusters", type=int, default=8, help="Centroids per corpus")
+    parser.add_argument("--calibrate", help="Print the score of each question in this file (one per line)")
+    args = parser.parse_args()
+
+    if not args.calibrate or not os.path.exists(args.out):
+        classifier = build_scope_classifier(clusters=args.clusters)
+        classifier.save(args.out)
+        print(f"Scope centroids written to {args.out}")
+    else:
+        classifier = ScopeClassifier.load(args.out)
+
+    if args.calibrate:
+        from langchain.embeddings.openai import OpenAIEmbeddings
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        with open(args.calibrate) as f:
+            questions = [line.strip() for line in f if line.strip()]
+        vectors = OpenAIEmbeddings(model="text-embedding-ada-002").embed_documents(questions)
+        for question, vector in sorted(zip(questions, vectors), key=lambda pair: -classifier.score(pair[1])[0]):
+            similarity, corpus = classifier.score(vector)
+            print(f"{similarity:.3f}  {corpus:<13} {question}")
@@ -0,0 +1,106 @@
+import threading
+
+
+class SemanticCache:
+    """
+    Second cache tier that serves paraphrased questions.
+
+    Normalized queries are embedded and stored in a Chroma collection (HNSW index,
+    cosine space) whose metadata points at the exact-match answer cache key. A new
+    query is a hit when a cached neighbour with cosine similarity of at least
+    `threshold` still has an unexpired answer; the closest `candidates` neighbours
+    are checked in order, so an expired entry does not hide a valid one behind it,
+    and expired entries found on the way are deleted from the collection. Lookups
+    that land within `near_miss_margin` below the threshold are counted as near
+    misses, which helps when tuning the threshold.
+
+    The default threshold is deliberately strict: ada-002 embeddings of different
+    questions on the same topic ("how do corals bleach?" / "why do corals bleach?")
+    commonly score 0.95-0.97, and serving one of those the other's answer is worse
+    than a miss.
+    """
+
+    def __init__(self, vector_store, answer_cache, threshold=0.98, near_miss_margin=0.03, candidates=5):
+        self.vector_store = vector_store
+        self.answer_cache = answer_cache
+        self.threshold = threshold
+        self.near_miss_margin = near_miss_margin
+        self.candidates = candidates
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "near_misses": 0, "expired": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def lookup(self, query_embedding):
+        """
+        Return (cached_entry, similarity) for the closest cached question with an
+        unexpired answer, or (None, similarity of the closest question) on a miss.
+        similarity is None if the index is empty.
+        """
+        try:
+            matches = self.vector_store.similarity_search_by_vector_with_relevance_scores(
+                query_embedding, k=self.candidates
+            )
+        except Exception as e:
+            print(f"Warning: Semantic cache lookup failed - {e}")
+            matches = []
+
+        if not matches:
+            self._count("misses")
+            return None, None
+
+        best_similarity = 1.0 - matches[0][1] # cosine distance -> cosine similarity
+        cached = None
+        expired_ids = []
+        # Matches come closest first, so stop at the first one below the threshold
+        for doc, distance in matches:
+            similarity = 1.0 - distance
+            if similarity < self.threshold:
+                break
+            cached = self.answer_cache.get(doc.metadata["cache_key"])
+            if cached is not None:
+                break
+            self._count("expired")
+            expired_ids.append(doc.metadata["cache_key"])
+
+        if expired_ids:
+            self._delete(expired_ids)
+
+        if cached is None:
+            self._count("misses")
+            if self.threshold - self.near_miss_margin <= best_similarity < self.threshold:
+                self._count("near_misses")
+            return None, best_similarity
+
+        self._count("hits")
+        return cached, similarity
+
+    def _delete(self, ids):
+        # Entries are indexed under their answer cache key (see add())
+        try:
+            self.vector_store._collection.delete(ids=ids)
+        except Exception as e:
+            print(f"Warning: Failed to delete expired semantic cache entries - {e}")
+
+    def add(self, normalized_query, query_embedding, cache_key):
+        """Index a normalized query so later paraphrases can find `cache_key`."""
+        try:
+            self.vector_store._collection.upsert(
+                ids=[cache_key],
+                embeddings=[query_embedding],
+                documents=[normalized_query],
+                metadatas=[{"cache_key": cache_key}]
+            )
+        except Exception as e:
+            print(f"Warning: Failed to index query in semantic cache - {e}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["lookups"] = lookups
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        stats["threshold"] = self.threshold
+        return stats
@@ -0,0 +1,170 @@
+import asyncio
+import fcntl
+import os
+import threading
+import time
+
+from contextlib import asynccontextmanager, contextmanager
+
+
+class Flight:
+    """
+    Handle yielded by SingleFlight.flight().
+
+    If `coalesced` is True, `result` already holds another request's answer.
+    Otherwise the caller computes the answer itself and stores it with set_result().
+    """
+
+    def __init__(self, result=None, coalesced=False):
+        self.result = result
+        self.coalesced = coalesced
+
+    def set_result(self, result):
+        self.result = result
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent computations of the same key.
+
+    Within a process, the first caller for a key becomes the leader and other threads
+    wait for its result. Across worker processes on one host, leaders also take an
+    flock on `<lock_dir>/<key>.lock`; a process that finds the lock held waits for it
+    to be released and then reads the other process's answer through `lookup`
+    (normally the shared answer cache). If waiting times out or the leader fails,
+    callers fall back to computing the answer themselves.
+    """
+
+    def __init__(self, lock_dir, wait_timeout=180.0, poll_interval=0.05):
+        self.lock_dir = lock_dir
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        os.makedirs(lock_dir, exist_ok=True)
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "coalesced_threads": 0, "coalesced_processes": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _wait_for_process_lock(self, lock_file):
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                time.sleep(self.poll_interval)
+        return False
+
+    @contextmanager
+    def flight(self, key, lookup):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            # Another thread in this process is computing the same key
+            call.done.wait(self.wait_timeout)
+            if call.result is not None:
+                self._count("coalesced_threads")
+                yield Flight(call.result, coalesced=True)
+            else:
+                yield Flight()
+            return
+
+        lock_file = open(os.path.join(self.lock_dir, f"{key}.lock"), "a")
+        locked = False
+        try:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                locked = True
+            except BlockingIOError:
+                # Another worker process is computing the same key: wait, then reuse its answer
+                locked = self._wait_for_process_lock(lock_file)
+                result = lookup()
+                if result is not None:
+                    self._count("coalesced_processes")
+                    call.result = result
+                    yield Flight(result, coalesced=True)
+                    return
+
+            self._count("leaders")
+            flight = Flight()
+            yield flight
+            call.result = flight.result
+        finally:
+            if locked:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    @asynccontextmanager
+    async def aflight(self, key, alookup):
+        """
+        Cross-process half of flight() for asyncio callers, which coalesce within
+        the process themselves (e.g. with a task per key). The flock is polled
+        without blocking and waits are spent in asyncio.sleep, so a query waiting
+        on another process holds no thread. `alookup` is an async callable.
+        """
+        lock_file = open(os.path.join(self.lock_dir, f"{key}.lock"), "a")
+        locked = False
+        waited = False
+        try:
+            deadline = time.monotonic() + self.wait_timeout
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                    break
+                except BlockingIOError:
+                    waited = True
+                    if time.monotonic() >= deadline:
+                        break
+                    await asyncio.sleep(self.poll_interval)
+
+            if waited:
+                # Another worker process computed the same key: reuse its answer
+                result = await alookup()
+                if result is not None:
+                    self._count("coalesced_processes")
+                    yield Flight(result, coalesced=True)
+                    return
+
+            self._count("leaders")
+            yield Flight()
+        finally:
+            if locked:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def run(self, key, compute, lookup):
+        """Return (result, coalesced), computing the result only if no one else is."""
+        with self.flight(key, lookup) as flight:
+            if flight.coalesced:
+                return flight.result, True
+            flight.set_result(compute())
+            return flight.result, False
+
+    def in_flight(self, key):
+        """True while a thread in this process is computing `key`."""
+        with self._lock:
+            return key in self._calls
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        stats["coalesced"] = stats["coalesced_threads"] + stats["coalesced_processes"]
+        return stats
@@ -0,0 +1,55 @@
+import hashlib
+import json
+
+
+class StageCache:
+    """
+    Memoizes individual pipeline stages in a SQLiteCache, next to the final answers.
+
+    Each stage has its own TTL in seconds (None = never expires, 0 = not memoized).
+    Keys are namespaced by stage and hash the stage's inputs, so a stage whose inputs
+    change (e.g. a consolidation over a refreshed web answer) is recomputed even if
+    an older entry has not expired yet.
+    """
+
+    def __init__(self, cache, ttls, metrics=None):
+        self.cache = cache
+        self.ttls = ttls
+        self.metrics = metrics
+
+    def enabled(self, stage):
+        return self.ttls.get(stage, 0) != 0
+
+    @staticmethod
+    def key(stage, *inputs):
+        digest = hashlib.md5(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+        return f"stage:{stage}:{digest}"
+
+    def get(self, stage, *inputs):
+        """Return the memoized output of `stage` for `inputs`, or None."""
+        if not self.enabled(stage):
+            return None
+        try:
+            value, status = self.cache.lookup(self.key(stage, *inputs))
+        except Exception as e:
+            print(f"Warning: Failed to read {stage} stage cache - {e}")
+            return None
+        if self.metrics is not None:
+            self.metrics.inc("oc_stage_cache_requests_total", stage=stage, result=status)
+        return value if status == "hit" else None
+
+    def set(self, stage, value, *inputs):
+        if not self.enabled(stage):
+            return
+        try:
+            self.cache.set(self.key(stage, *inputs), value, ttl=self.ttls[stage])
+        except Exception as e:
+            print(f"Warning: Failed to write {stage} stage cache - {e}")
+
+    def memoize(self, stage, fn, *inputs):
+        """Return the memoized output of `stage` for `inputs`, computing it with fn() on a miss."""
+        value = self.get(stage, *inputs)
+        if value is None:
+            value = fn()
+            self.set(stage, value, *inputs)
+        return value
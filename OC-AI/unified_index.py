@@ -0,0 +1,122 @@
+"""
+Unified vector index over the oceanography, IPCC and Duarte corpora.
+
+Copies the three Chroma stores into one collection, tagging every chunk with its
+`corpus` plus the source/title shown in snippet citations, so the app opens one
+store and runs one search per query instead of three. Embeddings are copied as-is,
+so building the index makes no embedding API calls.
+
+Usage:
+    python unified_index.py --out ./data/unified_rag_db
+"""
+import argparse
+import os
+
+from langchain.vectorstores import Chroma
+
+# Chroma persist directory of each corpus
+DATA_DIR = os.getenv("OC_DATA_DIR", "./data")
+CORPUS_DIRS = {
+    "oceanography": os.path.join(DATA_DIR, "oceanography_rag_db"),
+    "ipcc": os.path.join(DATA_DIR, "oceans_rag_db"),
+    "duarte": os.path.join(DATA_DIR, "duarte_rag_db"),
+}
+
+# Label used for each corpus in the RAG prompt
+CORPUS_LABELS = {
+    "oceanography": "Segar et al. (2018)",
+    "ipcc": "IPCC",
+    "duarte": "Duarte",
+}
+
+# Citation metadata the corpus chunks do not carry themselves
+CORPUS_METADATA = {
+    "oceanography": {
+        "source": "Segar et al. (2018)",
+        "title": "Ocean Studies - Introduction to Oceanography Fourth Edition",
+    },
+}
+
+
+def tag_metadata(metadata, corpus):
+    metadata = dict(metadata or {})
+    metadata["corpus"] = corpus
+    metadata.update(CORPUS_METADATA.get(corpus, {}))
+    return metadata
+
+def tag_document(doc, corpus):
+    doc.metadata = tag_metadata(doc.metadata, corpus)
+    return doc
+
+def search_unified_index(vector_store, query_embedding, k=5, global_k=None, overfetch=2):
+    """
+    Search the unified index once and split the hits by corpus.
+
+    By default returns the top `k` chunks of every corpus. With `global_k`, returns
+    the global top `global_k` chunks instead, with at most `k` from any one corpus.
+    Returns a dict keyed by corpus name; documents are already tagged.
+    """
+    corpora = list(CORPUS_DIRS)
+    matches = vector_store.similarity_search_by_vector_with_relevance_scores(
+        query_embedding, k=k * len(corpora) * overfetch
+    )
+
+    results = {name: [] for name in corpora}
+    total = 0
+    for doc, _ in matches:
+        corpus = doc.metadata.get("corpus")
+        if corpus not in results or len(results[corpus]) >= k:
+            continue
+        if global_k is not None and total >= global_k:
+            break
+        results[corpus].append(doc)
+        total += 1
+
+    if global_k is None:
+        # A corpus crowded out of the shared candidate list gets its own filtered search
+        for name in corpora:
+            if len(results[name]) < k:
+                results[name] = vector_store.similarity_search_by_vector(
+                    query_embedding, k=k, filter={"corpus": name}
+                )
+    return results
+
+
+def build_unified_index(out_dir, corpus_dirs=CORPUS_DIRS, batch_size=2000):
+    unified = Chroma(persist_directory=out_dir)
+
+    for corpus, persist_directory in corpus_dirs.items():
+        if not os.path.isdir(persist_directory):
+            raise FileNotFoundError(f"No Chroma store at {persist_directory}")
+        source = Chroma(persist_directory=persist_directory)
+
+        copied = 0
+        while True:
+            batch = source._collection.get(
+                include=["embeddings", "documents", "metadatas"],
+                limit=batch_size,
+                offset=copied
+            )
+            if not batch["ids"]:
+                break
+            unified._collection.upsert(
+                ids=[f"{corpus}:{doc_id}" for doc_id in batch["ids"]],
+                embeddings=batch["embeddings"],
+                documents=batch["documents"],
+                metadatas=[tag_metadata(metadata, corpus) for metadata in batch["metadatas"]]
+            )
+            copied += len(batch["ids"])
+        print(f"Copied {copied} chunks from {corpus} ({persist_directory})")
+
+    if hasattr(unified, "persist"):
+        unified.persist()
+    print(f"Unified index written to {out_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the unified multi-source vector index.")
+    parser.add_argument("--out", default="./data/unified_rag_db", help="Output Chroma persist directory")
+    parser.add_argument("--batch-size", type=int, default=2000, help="Chunks copied per batch")
+    args = parser.parse_args()
+
+    build_unified_index(args.out, batch_size=args.batch_size)
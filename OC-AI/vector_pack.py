@@ -0,0 +1,257 @@
+"""
+Compact, read-only vector packs for the oceanography, IPCC and Duarte corpora.
+
+A pack stores a corpus's chunk embeddings as float16 or int8 in a .npy file that
+is memory-mapped, not loaded: every gunicorn worker on a host shares the same
+pages through the OS page cache instead of holding its own copy of the Chroma
+store. Chunk texts and metadata sit in a second file read only for the top hits.
+Search is an exact (brute-force) inner product over the unit-normalized vectors.
+
+Usage:
+    python vector_pack.py build --out ./data/vector_packs --dtype int8
+    python vector_pack.py recall --pack ./data/vector_packs --k 5
+    python vector_pack.py check
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+from langchain.schema import Document
+
+from unified_index import CORPUS_DIRS
+
+# Rows scored per matrix product. Each block is cast to float32 before scoring, so
+# a search holds at most SEARCH_BLOCK_ROWS x dimensions x 4 bytes of scratch
+# (2048 x 1536 x 4 = 12 MB for ada-002) on top of one float32 score per row
+SEARCH_BLOCK_ROWS = 2048
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def pack_scores(vectors, scales, query_embedding):
+    """Cosine similarity of a query to every packed row (float16, or int8 with per-dimension scales)."""
+    query = normalize(query_embedding)
+    if scales is not None:
+        # q . (x * scale) == (q * scale) . x, so the int8 rows are never dequantized
+        query = query * scales
+    scores = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+        block = vectors[start:start + SEARCH_BLOCK_ROWS]
+        scores[start:start + len(block)] = block.astype(np.float32) @ query
+    return scores
+
+def best_rows(scores, k):
+    """Indices of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+class VectorPack:
+    """
+    One corpus pack opened read-only. Implements the part of the LangChain vector
+    store interface the app uses (similarity_search_by_vector and the variant with
+    relevance scores), so it can stand in for a per-corpus Chroma store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.scales = (
+            np.load(os.path.join(path, "scales.npy")) if self.manifest["dtype"] == "int8" else None
+        )
+        self._records_fd = os.open(os.path.join(path, "records.jsonl"), os.O_RDONLY)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def top_k(self, query_embedding, k=5):
+        """Return [(row, cosine similarity)] of the k best rows, best first."""
+        scores = pack_scores(self.vectors, self.scales, query_embedding)
+        return [(int(row), float(scores[row])) for row in best_rows(scores, k)]
+
+    def record(self, row):
+        """The stored id, text and metadata of a row."""
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        # Positional read, so concurrent searches do not share a file position
+        return json.loads(os.pread(self._records_fd, end - start, start))
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=5):
+        results = []
+        for row, score in self.top_k(embedding, k):
+            record = self.record(row)
+            results.append((Document(page_content=record["text"], metadata=record["metadata"]), score))
+        return results
+
+    def similarity_search_by_vector(self, embedding, k=5, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k)]
+
+
+def quantize(vectors, dtype):
+    """Unit-normalize and cast to float16, or to int8 with one symmetric scale per dimension."""
+    vectors = normalize(vectors)
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.maximum(np.abs(vectors).max(axis=0), 1e-12) / 127.0
+    return np.round(vectors / scales).astype(np.int8), scales.astype(np.float32)
+
+def read_chroma_store(persist_directory, batch_size=2000):
+    from langchain.vectorstores import Chroma
+
+    if not os.path.isdir(persist_directory):
+        raise FileNotFoundError(f"No Chroma store at {persist_directory}")
+    store = Chroma(persist_directory=persist_directory)
+    ids, embeddings, documents, metadatas = [], [], [], []
+    while True:
+        batch = store._collection.get(
+            include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=len(ids)
+        )
+        if not batch["ids"]:
+            break
+        ids.extend(batch["ids"])
+        embeddings.extend(batch["embeddings"])
+        documents.extend(batch["documents"])
+        metadatas.extend(batch["metadatas"])
+    return ids, embeddings, documents, metadatas
+
+def build_vector_pack(persist_directory, out_dir, dtype="int8"):
+    ids, embeddings, documents, metadatas = read_chroma_store(persist_directory)
+    os.makedirs(out_dir, exist_ok=True)
+
+    vectors, scales = quantize(embeddings, dtype)
+    np.save(os.path.join(out_dir, "vectors.npy"), vectors)
+    if scales is not None:
+        np.save(os.path.join(out_dir, "scales.npy"), scales)
+
+    offsets = [0]
+    with open(os.path.join(out_dir, "records.jsonl"), "wb") as f:
+        for doc_id, text, metadata in zip(ids, documents, metadatas):
+            line = (json.dumps({"id": doc_id, "text": text, "metadata": metadata or {}}) + "\n").encode()
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    np.save(os.path.join(out_dir, "offsets.npy"), np.array(offsets, dtype=np.int64))
+
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump({"dtype": dtype, "count": len(ids), "dimensions": int(vectors.shape[1]) if len(ids) else 0}, f)
+    return len(ids), vectors.nbytes
+
+
+def recall_report(pack_dir, corpus_dirs=CORPUS_DIRS, k=5, sample=200, queries=None, seed=0):
+    """
+    Recall@k of each pack against the float32 Chroma store it was built from.
+
+    Query vectors are embedded held-out `queries` (normally questions, which are not
+    in the store). If None, stored chunk embeddings sampled from the store are used
+    instead (no API calls); each of those is its own exact match, so its own id is
+    left out of both result lists, or recall would be inflated by a guaranteed hit.
+    """
+    from langchain.vectorstores import Chroma
+
+    rng = np.random.default_rng(seed)
+    for corpus, persist_directory in corpus_dirs.items():
+        pack = VectorPack(os.path.join(pack_dir, corpus))
+        store = Chroma(persist_directory=persist_directory)
+        if queries is None:
+            rows = rng.choice(len(pack), min(sample, len(pack)), replace=False)
+            own_ids = [pack.record(int(row))["id"] for row in rows]
+            stored = store._collection.get(ids=own_ids, include=["embeddings"])
+            # get() does not promise the order of the requested ids
+            query_vectors = stored["embeddings"]
+            own_ids = stored["ids"]
+        else:
+            query_vectors = queries
+            own_ids = [None] * len(queries)
+
+        # One extra result, so k remain after a sampled chunk drops itself
+        n = k + 1 if queries is None else k
+        recalls = []
+        for vector, own_id in zip(query_vectors, own_ids):
+            exact = store._collection.query(
+                query_embeddings=[np.asarray(vector, dtype=float).tolist()], n_results=n
+            )["ids"][0]
+            approximate = [pack.record(row)["id"] for row, _ in pack.top_k(vector, n)]
+            expected = set([doc_id for doc_id in exact if doc_id != own_id][:k])
+            found = set([doc_id for doc_id in approximate if doc_id != own_id][:k])
+            recalls.append(len(expected & found) / max(len(expected), 1))
+        print(
+            f"{corpus}: recall@{k} {np.mean(recalls):.4f} (min {np.min(recalls):.2f}) over {len(recalls)} "
+            f"{'stored-chunk' if queries is None else 'held-out'} queries, "
+            f"{pack.manifest['dtype']} pack {pack.vectors.nbytes / 2**20:.1f} MB"
+        )
+
+
+def synthetic_recall(dtype="int8", count=5000, dimensions=256, clusters=25, noise=0.05, k=5, n_queries=200, seed=0):
+    """
+    Recall@k of a quantized pack against exact float32 search on synthetic
+    clustered vectors. Members of a cluster score within a few thousandths of each
+    other, as chunks on one topic do, so quantization error reorders the top k.
+    """
+    rng = np.random.default_rng(seed)
+    centres = normalize(rng.standard_normal((clusters, dimensions)))
+    vectors = normalize(centres[rng.integers(clusters, size=count)] + noise * rng.standard_normal((count, dimensions)))
+    queries = normalize(centres[rng.integers(clusters, size=n_queries)] + noise * rng.standard_normal((n_queries, dimensions)))
+
+    packed, scales = quantize(vectors, dtype)
+    recalls = []
+    for query in queries:
+        expected = set(best_rows(vectors @ query, k).tolist())
+        found = set(best_rows(pack_scores(packed, scales, query), k).tolist())
+        recalls.append(len(expected & found) / k)
+    return float(np.mean(recalls))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and check memory-mapped vector packs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Export each corpus's Chroma store to a pack")
+    build.add_argument("--out", default="./data/vector_packs", help="Output directory (one pack per corpus)")
+    build.add_argument("--dtype", choices=["float16", "int8"], default="int8")
+
+    recall = subparsers.add_parser("recall", help="Compare pack search results with the Chroma stores")
+    recall.add_argument("--pack", default="./data/vector_packs")
+    recall.add_argument("--k", type=int, default=5)
+    recall.add_argument("--queries", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark", "queries.txt"),
+                        help="Held-out questions (one per line) embedded and used as queries")
+    recall.add_argument("--stored-chunks", action="store_true",
+                        help="Use sampled stored chunks as queries instead (no API calls; each excludes itself)")
+    recall.add_argument("--sample", type=int, default=200, help="Stored chunks used with --stored-chunks")
+
+    check = subparsers.add_parser("check", help="Check that int8 recall loss shows up on synthetic vectors")
+    check.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        for corpus, persist_directory in CORPUS_DIRS.items():
+            count, size = build_vector_pack(persist_directory, os.path.join(args.out, corpus), args.dtype)
+            print(f"Packed {count} chunks from {corpus} ({size / 2**20:.1f} MB of {args.dtype} vectors)")
+    elif args.command == "check":
+        # The comparison must be able to see precision loss: float16 stays (near) exact,
+        # int8 must drop below 1.0 on closely spaced neighbours
+        recalls = {dtype: synthetic_recall(dtype, k=args.k) for dtype in ("float16", "int8")}
+        for dtype, value in recalls.items():
+            print(f"synthetic {dtype}: recall@{args.k} {value:.4f}")
+        if recalls["int8"] >= 1.0 or recalls["float16"] < 0.99:
+            raise SystemExit("Synthetic recall check failed")
+    else:
+        query_vectors = None
+        if not args.stored_chunks:
+            from langchain.embeddings.openai import OpenAIEmbeddings
+            from dotenv import load_dotenv
+
+            load_dotenv()
+            with open(args.queries) as f:
+                questions = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+            query_vectors = OpenAIEmbeddings(model="text-embedding-ada-002").embed_documents(questions)
+        recall_report(args.pack, k=args.k, sample=args.sample, queries=query_vectors)
@@ -0,0 +1,142 @@
+"""
+Build or incrementally update the whoosh index over the scraped Ocean Central pages.
+
+Pages are keyed by URL and a hash of their title and content: unchanged pages are
+skipped, changed pages are replaced and pages no longer in the data file are
+deleted. The search snippet is computed here and stored with each page, while the
+full content is indexed but not stored, so a query only reads small stored fields.
+
+Usage:
+    python whoosh_index.py --data ./data/oceancentral_data.json --index-dir ./index --procs 4
+"""
+import argparse
+import hashlib
+import json
+import os
+
+from whoosh.fields import Schema, ID, TEXT, STORED
+from whoosh.index import create_in, exists_in, open_dir
+
+SNIPPET_LENGTH = 300
+
+SCHEMA = Schema(
+    url=ID(stored=True, unique=True),
+    title=TEXT(stored=True),
+    content=TEXT(stored=False),
+    snippet=STORED,
+    content_hash=ID(stored=True)
+)
+
+
+def make_snippet(content, snippet_length=SNIPPET_LENGTH):
+    """First `snippet_length` characters of `content`, cut back to the last full sentence."""
+    snippet = content[:snippet_length]
+    if len(content) > snippet_length:
+        last_period = snippet.rfind(". ")
+        if last_period != -1:
+            snippet = snippet[:last_period + 1]
+        return snippet.strip() + "..."
+    return snippet.strip()
+
+def page_hash(page, snippet_length=SNIPPET_LENGTH):
+    # The snippet length is part of the hash, so changing it refreshes every stored snippet
+    payload = json.dumps([page.get("title", ""), page.get("content", ""), snippet_length])
+    return hashlib.md5(payload.encode()).hexdigest()
+
+def open_or_create_index(index_dir, full=False):
+    """Open the index, or create an empty one if missing, requested, or on an older schema."""
+    os.makedirs(index_dir, exist_ok=True)
+    if not full and exists_in(index_dir):
+        ix = open_dir(index_dir)
+        if "content_hash" in ix.schema and "snippet" in ix.schema:
+            return ix, False
+        print("Index uses an older schema without stored snippets - rebuilding")
+    return create_in(index_dir, SCHEMA), True
+
+def indexed_hashes(ix):
+    with ix.searcher() as searcher:
+        return {fields["url"]: fields.get("content_hash") for fields in searcher.all_stored_fields()}
+
+def update_whoosh_index(pages, index_dir, procs=1, limitmb=256, multisegment=False, merge="default",
+                        full=False, snippet_length=SNIPPET_LENGTH):
+    """
+    Bring the index at `index_dir` in line with `pages` (dicts with url, title and content).
+
+    `procs`, `limitmb` and `multisegment` are passed to whoosh's writer. `merge` picks the
+    segment merge policy on commit: "default" merges small segments, "none" only adds
+    new segments, and "optimize" merges everything into one. Returns a dict of counts.
+    """
+    ix, created = open_or_create_index(index_dir, full)
+    existing = {} if created else indexed_hashes(ix)
+
+    pages_by_url = {page["url"]: page for page in pages}
+    changed = []
+    for url, page in pages_by_url.items():
+        content_hash = page_hash(page, snippet_length)
+        if existing.get(url) != content_hash:
+            changed.append((page, content_hash))
+    removed = [url for url in existing if url not in pages_by_url]
+
+    counts = {
+        "added": sum(1 for page, _ in changed if page["url"] not in existing),
+        "updated": sum(1 for page, _ in changed if page["url"] in existing),
+        "deleted": len(removed),
+        "unchanged": len(pages_by_url) - len(changed),
+    }
+    if not changed and not removed:
+        return counts
+
+    # Sub-writers only pay off for larger batches
+    writer_procs = procs if len(changed) >= procs * 10 else 1
+    writer = ix.writer(procs=writer_procs, limitmb=limitmb, multisegment=multisegment)
+    try:
+        for url in removed:
+            writer.delete_by_term("url", url)
+        for page, content_hash in changed:
+            if page["url"] in existing:
+                writer.delete_by_term("url", page["url"])
+            writer.add_document(
+                url=page["url"],
+                title=page.get("title", ""),
+                content=page.get("content", ""),
+                snippet=make_snippet(page.get("content", ""), snippet_length),
+                content_hash=content_hash
+            )
+    except Exception:
+        writer.cancel()
+        raise
+
+    if merge == "optimize":
+        writer.commit(optimize=True)
+    elif merge == "none":
+        writer.commit(merge=False)
+    else:
+        writer.commit()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the Ocean Central whoosh index.")
+    parser.add_argument("--data", default="./data/oceancentral_data.json", help="Scraped pages (JSON list)")
+    parser.add_argument("--index-dir", default="./index", help="Whoosh index directory")
+    parser.add_argument("--procs", type=int, default=os.cpu_count() or 1, help="Indexing processes")
+    parser.add_argument("--limitmb", type=int, default=256, help="Memory per indexing process, in MB")
+    parser.add_argument("--multisegment", action="store_true",
+                        help="Keep one segment per process instead of merging them on commit")
+    parser.add_argument("--merge", choices=["default", "none", "optimize"], default="default",
+                        help="Segment merge policy on commit")
+    parser.add_argument("--full", action="store_true", help="Rebuild the index from scratch")
+    parser.add_argument("--snippet-length", type=int, default=SNIPPET_LENGTH)
+    args = parser.parse_args()
+
+    with open(args.data, "r", encoding="utf-8") as f:
+        pages = json.load(f)
+
+    counts = update_whoosh_index(
+        pages, args.index_dir, procs=args.procs, limitmb=args.limitmb, multisegment=args.multisegment,
+        merge=args.merge, full=args.full, snippet_length=args.snippet_length
+    )
+    print(
+        f"Index {args.index_dir}: {counts['added']} added, {counts['updated']} updated, "
+        f"{counts['deleted']} deleted, {counts['unchanged']} unchanged"
+    )